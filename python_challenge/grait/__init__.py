@@ -4,6 +4,8 @@ from .utils import RDAPResponse
 from .utils import RDAPService
 from .geoip import GeoIP
 from .rdap import RDAP
+from .rdap import RDAPCache
 from .grabber import IPGrabber
+from .pipeline import Pipeline
 
 __version__ = '0.0.1'
@@ -1,36 +1,474 @@
 #!/usr/bin/env python3
 
-import csv
-import json
+import os
+import sys
+import time
+import mmap
+import heapq
+import bisect
+import struct
+import threading
 import ipaddress
 import functools
+import collections
+import multiprocessing
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 
 from pathlib import Path
 
 from typing import Any
 from typing import List
+from typing import Callable
+from typing import TextIO
+from typing import BinaryIO
 from typing import Type
+from typing import Tuple
 from typing import Union
 from typing import Literal
 from typing import Optional
+from typing import Iterable
+from typing import Generator
 
-from world_class import World
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, only GeoIP.batch_locate_array needs it.
+    np = None
 
-# This module is not really needed since we can get a Country from World()
+# This module is not really needed since we can get a Country from utils.get_country()
 # from world_class import Country
 
 from .utils import IPv4
 from .utils import IPCountry
-from .utils import get_octet
+from .utils import CompactIPCountry
+from .utils import get_country
+from .utils import chunked
+from .utils import json_dumps
+from .utils import write_ndjson
+from .utils import open_input
+from .utils import LRUCache
+from .utils import CacheInfo
+from .utils import ip_to_int
+from .utils import int_to_ipv4
+from .utils import int_to_ipv6
+from .utils import ipv4s_to_ints
+from .utils import GeoIPLoadReport
+
+
+class GeoIPIndex:
+    """GeoIPIndex.
+
+    A sorted interval index of IPv4 ranges. Keeps three parallel arrays
+    (range starts, range ends and country indexes) plus a table of country codes,
+    so a lookup is a single `bisect` over the starts.
+    Ranges never overlap: overlapping input is split into disjoint ranges where the
+    most specific (narrowest) range wins (see GeoIPIndex._disjoint).
+    IPv6 ranges live in a GeoIPIndex6 (see GeoIPIndex.ipv6) that shares the codes table.
+
+    Arguments:
+        starts: Sequence[int] -> sorted range starts
+        ends: Sequence[int] -> range ends, parallel to `starts`
+        countries: Sequence[int] -> indexes into `codes`, parallel to `starts`
+        codes: List[str] -> ["JP", "IN", ...]
+
+    Returns:
+        [GeoIPIndex]: A GeoIPIndex object.
+
+    The index can be dumped to a compact binary file (see GeoIPIndex.write) with this layout:
+    * header: magic, version, byte order, number of IPv4 and IPv6 ranges, size of the codes table.
+    * IPv4 starts: uint32[ranges]
+    * IPv4 ends: uint32[ranges]
+    * IPv4 countries: uint16[ranges] (padded to 8 bytes)
+    * IPv6 starts: uint64[ranges6] (high 64 bits), uint64[ranges6] (low 64 bits)
+    * IPv6 ends: uint64[ranges6] (high 64 bits), uint64[ranges6] (low 64 bits)
+    * IPv6 countries: uint16[ranges6] (padded to 8 bytes)
+    * codes: comma separated ASCII country codes.
+    """
+
+    MAGIC = b"GRAITGEO"
+    # 3: ranges are disjoint (files compiled before may hold overlapping ranges).
+    VERSION = 3
+    HEADER = struct.Struct("<8sHHIII")
+
+    def __init__(
+        self,
+        starts: array,
+        ends: array,
+        countries: array,
+        codes: List[str],
+        buffer: Optional[mmap.mmap] = None,
+    ) -> Literal[None]:
+        self.starts = starts
+        self.ends = ends
+        self.countries = countries
+        self.codes = codes
+        self.ipv6 = GeoIPIndex6.from_ranges([], codes=codes)
+        # keeps the mapping alive while the memoryviews above point into it.
+        self._buffer = buffer
+
+    @staticmethod
+    def _disjoint(ranges: Iterable[Tuple[int, int, str]]) -> Generator:
+        """Yields sorted, non overlapping, (first, last, country_code) triples.
+        Where ranges overlap, each IP goes to the narrowest range holding it (then to
+        the one starting first, then to the first one given), so an outer range is
+        split around the ranges nested in it. Non overlapping ranges are left as they are.
+
+        Arguments:
+                ranges: Iterable[Tuple[int, int, str]] -> [(16777216, 16842751, "AU"), (16777472, 16777727, "CN")]
+        Returns:
+                Yields (16777216, 16777471, "AU"), (16777472, 16777727, "CN"), (16777728, 16842751, "AU")
+        """
+        ranges = sorted((first, last, order, cc) for order, (first, last, cc) in enumerate(ranges))
+        if all(prev[1] < next_[0] for prev, next_ in zip(ranges, ranges[1:])):
+            # the usual case, nothing to split.
+            yield from ((first, last, cc) for first, last, _, cc in ranges)
+            return
+
+        bounds = sorted({first for first, *_ in ranges} | {last + 1 for _, last, *_ in ranges})
+        active, pending, idx = [], None, 0
+        for start, next_start in zip(bounds, bounds[1:]):
+            while idx < len(ranges) and ranges[idx][0] == start:
+                first, last, order, cc = ranges[idx]
+                heapq.heappush(active, (last - first, first, order, last, cc))
+                idx += 1
+            while active and active[0][3] < start:
+                heapq.heappop(active)
+            if not active:
+                continue
+            _, first, order, last, cc = active[0]
+            if pending and pending[2] == order and pending[1] == start - 1:
+                pending[1] = next_start - 1
+                continue
+            if pending:
+                yield pending[0], pending[1], pending[3]
+            pending = [start, next_start - 1, order, cc]
+        if pending:
+            yield pending[0], pending[1], pending[3]
+
+    @staticmethod
+    def _code_indexes(ranges: Iterable[Tuple[int, int, str]], codes: List[str]):
+        """Yields sorted, non overlapping, (first, last, country_index) triples
+        (see GeoIPIndex._disjoint), adding new codes to `codes`."""
+        code_idx = {cc: idx for idx, cc in enumerate(codes)}
+        for first, last, cc in GeoIPIndex._disjoint(ranges):
+            if cc not in code_idx:
+                code_idx[cc] = len(codes)
+                codes.append(cc)
+            yield first, last, code_idx[cc]
+
+    @classmethod
+    def from_ranges(
+        cls, ranges: Iterable[Tuple[int, int, str]], codes: Optional[List[str]] = None
+    ) -> "GeoIPIndex":
+        """Builds an index from (first, last, country_code) triples.
+
+        Arguments:
+                ranges: Iterable[Tuple[int, int, str]] -> [(17104896, 17170431, "JP"), ...]
+                codes: List[str], Optional -> a codes table to share (and extend)
+        Returns:
+                GeoIPIndex(...)
+        """
+        codes = [] if codes is None else codes
+        starts, ends, countries = array("I"), array("I"), array("H")
+        for first, last, country in cls._code_indexes(ranges, codes):
+            starts.append(first)
+            ends.append(last)
+            countries.append(country)
+
+        return cls(starts, ends, countries, codes)
+
+    @classmethod
+    def is_compiled(cls, path: Union[str, Path]) -> bool:
+        """Returns True if a file starts with the compiled index magic.
+
+        Arguments:
+                path: str,Path -> /path/to/GeoIPCountryWhois.bin
+        Returns:
+                bool
+        """
+        with open(path, "rb") as fobj:
+            return fobj.read(len(cls.MAGIC)) == cls.MAGIC
+
+    @classmethod
+    def from_compiled(cls, path: Union[str, Path]) -> "GeoIPIndex":
+        """Maps a compiled index file into memory. Lookups are answered straight
+        from the mapped pages, so processes using the same file share them.
+
+        Arguments:
+                path: str,Path -> /path/to/GeoIPCountryWhois.bin
+        Returns:
+                GeoIPIndex(...)
+        """
+        with open(path, "rb") as fobj:
+            buffer = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, byteorder, count, count6, codes_len = cls.HEADER.unpack_from(
+            buffer
+        )
+        assert magic == cls.MAGIC, ValueError("Not a compiled GeoIP file!")
+        assert version == cls.VERSION, ValueError(
+            f"Unsupported compiled GeoIP version: {version}"
+        )
+        assert byteorder == (sys.byteorder == "little"), ValueError(
+            "Compiled GeoIP file was built on a machine with a different byte order!"
+        )
+
+        view = memoryview(buffer)
+        offset = cls.HEADER.size
+        sections = []
+        layout = [("I", count)] * 2 + [("H", count)] + [("Q", count6)] * 4 + [("H", count6)]
+        for typecode, size in layout:
+            length = size * array(typecode).itemsize
+            sections.append(view[offset : offset + length].cast(typecode))
+            offset += length
+            if typecode == "H":
+                offset += -offset % 8
+        codes = bytes(view[offset : offset + codes_len]).decode("ascii").split(",")
+        codes = codes if codes_len else []
+
+        index = cls(*sections[:3], codes, buffer=buffer)
+        index.ipv6 = GeoIPIndex6(*sections[3:], codes)
+        return index
+
+    def write(self, fobj: BinaryIO) -> Literal[None]:
+        """Writes the index (and its IPv6 ranges) in its compiled binary format.
+
+        Arguments:
+                fobj: BinaryIO -> open("GeoIPCountryWhois.bin", "wb")
+        Returns:
+                ...
+        """
+        codes = ",".join(self.codes).encode("ascii")
+        header = self.HEADER.pack(
+            self.MAGIC,
+            self.VERSION,
+            sys.byteorder == "little",
+            len(self),
+            len(self.ipv6),
+            len(codes),
+        )
+        fobj.write(header)
+        offset = len(header)
+        for typecode, values in [
+            ("I", self.starts),
+            ("I", self.ends),
+            ("H", self.countries),
+            ("Q", self.ipv6.starts_hi),
+            ("Q", self.ipv6.starts_lo),
+            ("Q", self.ipv6.ends_hi),
+            ("Q", self.ipv6.ends_lo),
+            ("H", self.ipv6.countries),
+        ]:
+            data = array(typecode, values).tobytes()
+            if typecode == "H":
+                data += b"\0" * (-(offset + len(data)) % 8)
+            fobj.write(data)
+            offset += len(data)
+        fobj.write(codes)
+
+    def close(self) -> Literal[None]:
+        """Releases the memory mapping of a compiled index (a no-op otherwise).
+
+        Arguments:
+                ...
+        Returns:
+                ...
+        """
+        self.__dict__.pop("arrays", None)
+        if self._buffer is not None:
+            try:
+                for view in self._views():
+                    view.release()
+                self._buffer.close()
+            except BufferError:
+                # still exported (ie: numpy arrays held by a caller),
+                # the mapping is freed once those are gone.
+                pass
+            self._buffer = None
+
+    def _views(self) -> list:
+        """Returns the arrays of both indexes."""
+        return [self.starts, self.ends, self.countries] + self.ipv6._views()
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def ranges(self) -> Generator:
+        """Yields the (first, last, country_code) triples of the index, sorted.
+
+        Arguments:
+                ...
+        Returns:
+                Yields (17104896, 17170431, "JP"), ...
+        """
+        for first, last, country in zip(self.starts, self.ends, self.countries):
+            yield first, last, self.codes[country]
+
+    def count_overlaps(self) -> int:
+        """Returns how many ranges start before a previous one ended
+        (always 0 for an index, see count_overlaps).
+
+        Arguments:
+                ...
+        Returns:
+                0
+        """
+        return count_overlaps(self.ranges())
+
+    @functools.cached_property
+    def arrays(self) -> tuple:
+        """Returns (zero-copy) numpy views of starts, ends and countries, plus
+        the codes table with an extra "" entry for misses (country index -1)."""
+        return (
+            np.frombuffer(self.starts, dtype=np.uint32),
+            np.frombuffer(self.ends, dtype=np.uint32),
+            np.frombuffer(self.countries, dtype=np.uint16),
+            np.array(self.codes + [""]),
+        )
+
+    def find_array(self, ip_ints: "np.ndarray") -> tuple:
+        """Vectorized version of GeoIPIndex.find, a single `np.searchsorted` over the starts.
+
+        Arguments:
+                ip_ints: np.ndarray[uint32] -> array([17104897, 34604567, ...])
+        Returns:
+                (array([0, 10, -1, ...]), array(["JP", "DE", "", ...]))
+        """
+        starts, ends, countries, codes = self.arrays
+        idx = np.searchsorted(starts, ip_ints, side="right") - 1
+        found = idx >= 0
+        idx[~found] = 0
+        if len(starts):
+            found &= ip_ints <= ends[idx]
+            country_idx = np.where(found, countries[idx], -1).astype(np.int32)
+        else:
+            country_idx = np.full(len(ip_ints), -1, dtype=np.int32)
+
+        return country_idx, codes[country_idx]
+
+    def find(self, ip_int: int) -> Optional[str]:
+        """Returns the country code of the range containing an IP, if any.
+
+        Arguments:
+                ip_int: int -> 17104897
+        Returns:
+                "JP"
+        """
+        idx = bisect.bisect_right(self.starts, ip_int) - 1
+        if idx >= 0 and ip_int <= self.ends[idx]:
+            return self.codes[self.countries[idx]]
+
+
+class GeoIPIndex6:
+    """GeoIPIndex6.
+
+    The IPv6 version of GeoIPIndex. 128-bit keys don't fit an array, so starts
+    and ends are split in high and low 64-bit arrays. A lookup bisects the high
+    halves first and then the low halves of the ranges sharing that high half.
+
+    Arguments:
+        starts_hi: Sequence[int] -> high 64 bits of the sorted range starts
+        starts_lo: Sequence[int] -> low 64 bits of the sorted range starts
+        ends_hi: Sequence[int] -> high 64 bits of the range ends
+        ends_lo: Sequence[int] -> low 64 bits of the range ends
+        countries: Sequence[int] -> indexes into `codes`
+        codes: List[str] -> ["JP", "IN", ...]
+
+    Returns:
+        [GeoIPIndex6]: A GeoIPIndex6 object.
+    """
+
+    MASK = (1 << 64) - 1
+
+    def __init__(
+        self,
+        starts_hi: array,
+        starts_lo: array,
+        ends_hi: array,
+        ends_lo: array,
+        countries: array,
+        codes: List[str],
+    ) -> Literal[None]:
+        self.starts_hi = starts_hi
+        self.starts_lo = starts_lo
+        self.ends_hi = ends_hi
+        self.ends_lo = ends_lo
+        self.countries = countries
+        self.codes = codes
+
+    @classmethod
+    def from_ranges(
+        cls, ranges: Iterable[Tuple[int, int, str]], codes: Optional[List[str]] = None
+    ) -> "GeoIPIndex6":
+        """Builds an index from (first, last, country_code) triples.
+
+        Arguments:
+                ranges: Iterable[Tuple[int, int, str]] -> [(42540528726795050063891204319802818560, ..., "JP"), ...]
+                codes: List[str], Optional -> a codes table to share (and extend)
+        Returns:
+                GeoIPIndex6(...)
+        """
+        codes = [] if codes is None else codes
+        index = cls(*[array("Q") for _ in range(4)], array("H"), codes)
+        for first, last, country in GeoIPIndex._code_indexes(ranges, codes):
+            index.starts_hi.append(first >> 64)
+            index.starts_lo.append(first & cls.MASK)
+            index.ends_hi.append(last >> 64)
+            index.ends_lo.append(last & cls.MASK)
+            index.countries.append(country)
+
+        return index
+
+    def _views(self) -> list:
+        """Returns the arrays of the index."""
+        return [self.starts_hi, self.starts_lo, self.ends_hi, self.ends_lo, self.countries]
+
+    def __len__(self) -> int:
+        return len(self.starts_hi)
+
+    def ranges(self) -> Generator:
+        """Yields the (first, last, country_code) triples of the index, sorted.
+
+        Arguments:
+                ...
+        Returns:
+                Yields (42540528726795050063891204319802818560, ..., "JP"), ...
+        """
+        for s_hi, s_lo, e_hi, e_lo, country in zip(*self._views()):
+            yield s_hi << 64 | s_lo, e_hi << 64 | e_lo, self.codes[country]
+
+    count_overlaps = GeoIPIndex.count_overlaps
+
+    def find(self, ip_int: int) -> Optional[str]:
+        """Returns the country code of the range containing an IP, if any.
+
+        Arguments:
+                ip_int: int -> 42540528726795050063891204319802818561
+        Returns:
+                "JP"
+        """
+        hi, lo = ip_int >> 64, ip_int & self.MASK
+        left = bisect.bisect_left(self.starts_hi, hi)
+        right = bisect.bisect_right(self.starts_hi, hi, left)
+        # the last range starting at (or before) the IP.
+        idx = bisect.bisect_right(self.starts_lo, lo, left, right) - 1
+        if idx >= 0 and (hi, lo) <= (self.ends_hi[idx], self.ends_lo[idx]):
+            return self.codes[self.countries[idx]]
 
 
 class GeoIP:
     """GeoIP.
 
-    Parses a Geo Legacy IP Range/Country CSV file and tries to geo-locate an IPv4.
+    Parses a Geo Legacy IP Range/Country CSV file and tries to geo-locate an IPv4 or IPv6.
+    IPv4 and IPv6 ranges can be mixed in the same file (ie: GeoIPCountryWhois.csv + GeoIPv6.csv).
 
     Arguments:
         geofile (str, Path): A Path obj or a string that represents a path file.
+        compact (bool): Merge contiguous ranges of the same country while loading.
+        cache_size (int): How many GeoIP.locate results to keep in an LRU cache (0 disables it).
+        compact_results (bool): Return (lightweight) CompactIPCountrys instead of IPCountrys.
 
     Returns:
         [GeoIP]: A GeoIP objects.
@@ -39,53 +477,89 @@ class GeoIP:
     GeoIP.get_country_range: Returns a list of (first, last) pairs of IPv4Networks for a Country.
     GeoIP.in_country_range: Returns a bool based on if an IPv4 is in a IPv4Network.
     GeoIP.locate: Returns an IPCountry (that is: an IP + a Country) based on an IP.
+        Lookups are answered by a GeoIPIndex built once while parsing the file.
     GeoIP.locate_serialized: Serialized version of GeoIP.locate
     GeoIP.batch_locate: Batch version of GeoIP.locate
     GeoIP.batch_locate_serialized: Batch version of GeoIP.locate_serialized
+    GeoIP.batch_locate_ndjson: Streaming (NDJSON) version of GeoIP.batch_locate_serialized
+    GeoIP.batch_locate_parallel: Multi-process version of GeoIP.batch_locate.
+    GeoIP.batch_locate_array: Vectorized (numpy) batch lookup, returns country indexes and codes.
+    GeoIP.compile: Writes a Geo Legacy CSV as a compiled (binary) GeoIP file.
+    GeoIP.from_compiled: Returns a GeoIP that answers lookups from a compiled file.
+    GeoIP.reload: Swaps the Geo Legacy file (and its caches) for a new one.
+    GeoIP.close: Frees the caches. GeoIP can also be used as a context manager.
+    GeoIP.load_report: A GeoIPLoadReport (rows, rejects, overlaps, elapsed) of the last load.
+    GeoIP.cache_info: Hits, misses and evictions of the GeoIP.locate cache.
     """
 
-    _country_cache = {}
-    _octet_cache = {}
+    CHUNK_SIZE = 1024 * 1024
 
-    def __init__(self, geofile: Union[str, Path]) -> Literal[None]:
+    def __init__(
+        self,
+        geofile: Union[str, Path],
+        compact: bool = False,
+        cache_size: int = 0,
+        compact_results: bool = False,
+    ) -> Literal[None]:
         self.geofile = geofile
+        self.compact = compact
+        self.cache_size = cache_size
+        self.compact_results = compact_results
+        self._result_type = CompactIPCountry if compact_results else IPCountry
         if not hasattr(self.geofile, "exists"):
             self.geofile = Path(self.geofile)
         assert self.geofile.exists(), FileNotFoundError(
             "Geo Legacy file doesn't exists!"
         )
+        self.closed = False
+        self.load_report = None
+        self._lock = threading.Lock()
+        self._country_cache = None
+        self._octet_cache = None
+        self._locate_cache = LRUCache(cache_size) if cache_size else None
         self._parse
 
-    def _update_cache(self, cc: str, first_ip: str, last_ip: str) -> Literal[None]:
+    def __enter__(self) -> "GeoIP":
+        return self
+
+    def __exit__(self, *exc_info) -> Literal[None]:
+        self.close()
+
+    def _update_cache(self) -> Literal[None]:
         """
         GeoIP contains two caches:
         * _country_cache = {COUNTRY_CODE: (ranges), ...}
         * _octet_cache = {IP_FIRST_OCTET: [COUNTRY_CODES, ...], ...}
 
-        This `private` method, updates both.
+        Both are per instance, so GeoIPs built from different files never share ranges.
+        Lookups don't need them (see GeoIPIndex), so this `private` method builds both
+        from the index the first time they're queried.
 
         Arguments:
-                cc: str -> Country Code
-                first_ip: str -> 1.2.3.0
-                last_ip: str -> 1.2.3.255
+                ...
         Returns:
                 ...
         """
-        first_oct = get_octet(first_ip)
-        last_oct = get_octet(last_ip)
-        octets = [first_oct, last_oct] if first_oct != last_oct else [first_oct]
-        # First octet_cache
-        for octet in octets:
-            if octet not in list(GeoIP._octet_cache.keys()):
-                GeoIP._octet_cache.update({octet: set([cc])})
-            else:
-                GeoIP._octet_cache[octet].add(cc)
-        # Then the country_cache
-        if cc not in list(GeoIP._country_cache.keys()):
-            GeoIP._country_cache.update({cc: [(first_ip, last_ip)]})
-        else:
-            GeoIP._country_cache[cc].append((first_ip, last_ip))
-        # that's all.
+        with self._lock:
+            if self._country_cache is not None:
+                return
+
+            country_cache, octet_cache = {}, {}
+            index = self._parse
+            for first, last, cc in index.ranges():
+                country_cache.setdefault(cc, []).append(
+                    (int_to_ipv4(first), int_to_ipv4(last))
+                )
+                for octet in {str(first >> 24), str(last >> 24)}:
+                    octet_cache.setdefault(octet, set()).add(cc)
+            # IPv6 ranges have no (IPv4) first octet.
+            for first, last, cc in index.ipv6.ranges():
+                country_cache.setdefault(cc, []).append(
+                    (int_to_ipv6(first), int_to_ipv6(last))
+                )
+
+            self._octet_cache = octet_cache
+            self._country_cache = country_cache
 
     def _query_cache(self, which: str, key: Any) -> Any:
         """A private generic methods to query both caches.
@@ -96,50 +570,202 @@ class GeoIP:
         Returns:
                 Any object cached based on its `key`.
         """
-        cache_ = getattr(GeoIP, f"_{which}_cache")
+        if self._country_cache is None:
+            self._update_cache()
+        cache_ = getattr(self, f"_{which}_cache")
         return cache_.get(key, None)
 
-    def _read(self) -> Literal[None]:
-        """Reads a Geo Legacy IP CSV.
+    def _read(self) -> Generator:
+        """Reads a Geo Legacy IP CSV in large binary chunks.
+        Compressed CSVs (gzip, bz2, xz, zstd) are decompressed on the fly,
+        in a background thread (see utils.open_input).
 
         Arguments:
                 ...
         Returns:
-                Yields (CSV) lines.
+                Yields (bytes) lines.
         """
-        with open(self.geofile, "r") as geo:
-            for row in csv.reader(geo, delimiter=","):
-                yield row
+        with open_input(self.geofile, "rb") as geo:
+            tail = b""
+            for chunk in iter(functools.partial(geo.read, self.CHUNK_SIZE), b""):
+                lines = (tail + chunk).split(b"\n")
+                tail = lines.pop()
+                yield from lines
+            if tail:
+                yield tail
 
-    def _process(self, row: list) -> dict:
-        """A `private` method to process csv rows and update GeoIP cache.
+    def _process(self, line: bytes) -> Tuple[int, int, int, str]:
+        """A `private` method to process a csv line. Only the integer columns and
+        the country code are used, the IPs (and country name) are skipped, except
+        to tell IPv4 rows from IPv6 ones.
 
         Arguments:
-                row: list -> ["1.2.3.4", "1.2.3.255", "123123123", "123123125", "AR", "Argentina"]
+                line: bytes -> b'"1.2.3.4","1.2.3.255","16909060","16909311","AR","Argentina"'
         Returns:
-                ...
+                (4, 16909060, 16909311, "AR")
+        """
+        row = line.split(b",", 5)
+        assert len(row) == 6, "Malformed Geo Legacy file, there are missing columns!"
+        first_ip, _1, first, last, country_code, _2 = row
+        version = 6 if b":" in first_ip else 4
+        first, last = int(first.strip(b'" ')), int(last.strip(b'" '))
+        assert first <= last < 1 << (32 if version == 4 else 128), (
+            f"Invalid IPv{version} range: {first} - {last}"
+        )
+        return version, first, last, country_code.strip(b'" ').decode("ascii")
+
+    def _compact(
+        self,
+        ranges: List[Tuple[int, int, str]],
+        report: GeoIPLoadReport,
+        to_ip: Callable = int_to_ipv4,
+    ) -> List[Tuple[int, int, str]]:
+        """A `private` method that merges contiguous (or overlapping) ranges of the same
+        country into a single range. Ranges are made disjoint first (see GeoIPIndex._disjoint),
+        so lookups answer the same as without compacting. Overlapping ranges of different
+        countries are reported as conflicts in the GeoIPLoadReport.
+
+        Arguments:
+                ranges: List[Tuple[int, int, str]] -> [(16909056, 16909311, "AR"), (16909312, 16909567, "AR")]
+                report: GeoIPLoadReport -> GeoIPLoadReport(...)
+                to_ip: Callable -> int_to_ipv4 or int_to_ipv6, to report conflicts
+        Returns:
+                [(16909056, 16909567, "AR")]
         """
-        first_ip, last_ip, _1, _2, country_code, _3 = row
-        self._update_cache(country_code, first_ip, last_ip)
+        last_end, last_cc = -1, None
+        for first, last, cc in sorted(ranges):
+            if first <= last_end and cc != last_cc:
+                report.conflict(
+                    f"{to_ip(first)}-{to_ip(last)} ({cc}) overlaps "
+                    f"a range of {last_cc} ending at {to_ip(last_end)}"
+                )
+            if last > last_end:
+                last_end, last_cc = last, cc
+
+        compacted = []
+        for first, last, cc in GeoIPIndex._disjoint(ranges):
+            if compacted and cc == compacted[-1][2] and first == compacted[-1][1] + 1:
+                compacted[-1] = (compacted[-1][0], last, cc)
+                report.merged += 1
+            else:
+                compacted.append((first, last, cc))
+
+        return compacted
 
     @functools.cached_property
     def _parse(self):
         """A `private` method to parse the CSV file.
+        Malformed rows are skipped and counted in GeoIP.load_report.
 
         Arguments:
                 ...
+        Returns:
+                GeoIPIndex(...)
+        """
+        assert not self.closed, ValueError("GeoIP is closed!")
+        started = time.perf_counter()
+        report = GeoIPLoadReport()
+        if GeoIPIndex.is_compiled(self.geofile):
+            index = GeoIPIndex.from_compiled(self.geofile)
+            report.rows = len(index) + len(index.ipv6)
+        else:
+            ranges = {4: [], 6: []}
+            for line_no, line in enumerate(self._read(), 1):
+                if not line.strip():
+                    continue
+                report.rows += 1
+                try:
+                    version, first, last, cc = self._process(line)
+                except (AssertionError, ValueError) as e:
+                    report.reject(line_no, e)
+                else:
+                    ranges[version].append((first, last, cc))
+            # the index (and compacting) splits them, so they're counted before.
+            report.overlaps = count_overlaps(ranges[4]) + count_overlaps(ranges[6])
+            if self.compact:
+                ranges[4] = self._compact(ranges[4], report)
+                ranges[6] = self._compact(ranges[6], report, int_to_ipv6)
+            index = GeoIPIndex.from_ranges(ranges[4])
+            index.ipv6 = GeoIPIndex6.from_ranges(ranges[6], codes=index.codes)
+
+        report.elapsed = time.perf_counter() - started
+        self.load_report = report
+        return index
+
+    @classmethod
+    def compile(
+        cls,
+        csv_path: Union[str, Path],
+        out_path: Union[str, Path],
+        compact: bool = False,
+    ) -> Literal[None]:
+        """Parses a Geo Legacy CSV and writes it as a compiled GeoIP file,
+        that can be loaded (in milliseconds) with GeoIP.from_compiled.
+
+        Arguments:
+                csv_path: str,Path -> /path/to/GeoIPCountryWhois.csv
+                out_path: str,Path -> /path/to/GeoIPCountryWhois.bin
+                compact: bool -> Merge contiguous ranges of the same country.
         Returns:
                 ...
         """
-        for row in self._read():
-            try:
-                assert (
-                    len(row) == 6
-                ), "Malformed Geo Legacy file, there are missing columns!"
-            except Exception as e:
-                print(f"[-] ERR: {e}")
-            else:
-                self._process(row)
+        index = cls(csv_path, compact=compact)._parse
+        with open(out_path, "wb") as out:
+            index.write(out)
+
+    @classmethod
+    def from_compiled(cls, path: Union[str, Path]) -> "GeoIP":
+        """Returns a GeoIP backed by a compiled GeoIP file (see GeoIP.compile).
+        The file is `mmap`ed instead of parsed.
+
+        Arguments:
+                path: str,Path -> /path/to/GeoIPCountryWhois.bin
+        Returns:
+                GeoIP(...)
+        """
+        assert GeoIPIndex.is_compiled(path), ValueError("Not a compiled GeoIP file!")
+        return cls(path)
+
+    def reload(self, geofile: Union[str, Path]) -> Literal[None]:
+        """Builds the caches for a new Geo Legacy (or compiled) file on the side
+        and swaps them in. Lookups keep being answered by the previous file until
+        the swap, and never by a mix of both. The previous caches are freed once
+        no lookup is using them. The GeoIP.locate cache starts empty.
+
+        Arguments:
+                geofile: str,Path -> /path/to/GeoIPCountryWhois.csv
+        Returns:
+                ...
+        """
+        fresh = type(self)(
+            geofile,
+            compact=self.compact,
+            cache_size=self.cache_size,
+            compact_results=self.compact_results,
+        )
+        state = {
+            attr: value for attr, value in fresh.__dict__.items() if attr != "_lock"
+        }
+        with self._lock:
+            # a single dict.update, readers see either the old or the new state.
+            self.__dict__.update(state)
+
+    def close(self) -> Literal[None]:
+        """Frees the caches (and unmaps a compiled file). Lookups on a closed GeoIP fail.
+
+        Arguments:
+                ...
+        Returns:
+                ...
+        """
+        with self._lock:
+            index = self.__dict__.pop("_parse", None)
+            self._country_cache = {}
+            self._octet_cache = {}
+            self._locate_cache = None
+            self.closed = True
+        if index is not None:
+            index.close()
 
     def get_country(self, country_code: str) -> dict:
         """Returns a Country from a country code.
@@ -149,12 +775,12 @@ class GeoIP:
         Returns:
                 Country(...)
         """
-        return World().find_by_code(value=country_code)
+        return get_country(country_code)
 
     def get_country_range(
         self, country_code: str, first_octet: Optional[Union[int, str]] = None
     ) -> list:
-        """Returns a list of (first, last) pairs of IPv4Networks for a Country.
+        """Returns a list of (first, last) pairs of IPv4Networks (and IPv6Networks) for a Country.
 
         Arguments:
                 country_code -> "AR"
@@ -174,50 +800,112 @@ class GeoIP:
         return country_ranges
 
     def in_country_range(
-        self, country_ranges: list, ip_addr: Union[str, IPv4, ipaddress.IPv4Address]
+        self,
+        country_ranges: list,
+        ip_addr: Union[str, IPv4, ipaddress.IPv4Address, ipaddress.IPv6Address],
     ) -> bool:
-        """Returns a bool based on if an IPv4 is in a IPv4Network.
+        """Returns a bool based on if an IP is in a IPv4Network (or IPv6Network).
 
         Arguments:
                 country_ranges -> [(first_ip, last_ip), (another_first_ip, another_last_ip), ...]
-                ip_addr:str,IPv4,ipaddress.IPv4Address -> 190.10.22.63
+                ip_addr:str,IPv4,ipaddress.IPv4Address,ipaddress.IPv6Address -> 190.10.22.63
         Returns:
                 bool
         """
-        if isinstance(ip_addr, ipaddress.IPv4Address):
-            ip_addr = ip_addr.compressed
-
-        if isinstance(ip_addr, str):
-            ip_addr = IPv4(ip_addr)
-
+        version, ip_int = ip_to_int(ip_addr)
         for first, last in country_ranges:
-            first, last = [IPv4(_) for _ in [first, last]]
-            for net in ipaddress.summarize_address_range(first, last):
-                if ip_addr in net:
-                    return True
+            first_version, first = ip_to_int(first)
+            if first_version == version and first <= ip_int <= ip_to_int(last)[1]:
+                return True
 
         return False
 
+    def _find(
+        self,
+        ip_addr: Union[str, IPv4, ipaddress.IPv4Address, ipaddress.IPv6Address],
+    ) -> Optional[str]:
+        """A `private` method that returns the country code of an IP, if any.
+        IPv4-mapped IPv6 addresses (::ffff:N.N.N.N) not found in the IPv6 ranges
+        are located with the IPv4 ranges.
+
+        Arguments:
+                ip_addr:str,IPv4,ipaddress.IPv4Address,ipaddress.IPv6Address -> 190.10.22.63
+        Returns:
+                "AR"
+        """
+        return self._find_int(*ip_to_int(ip_addr))
+
+    def _find_int(self, version: int, ip_int: int) -> Optional[str]:
+        """See GeoIP._find, for an already parsed IP.
+
+        Arguments:
+                version: int -> 4
+                ip_int: int -> 3188331071
+        Returns:
+                "AR"
+        """
+        index = self._parse
+        if version == 4:
+            return index.find(ip_int)
+
+        cc = index.ipv6.find(ip_int)
+        if cc is None and ip_int >> 32 == 0xFFFF:
+            cc = index.find(ip_int & 0xFFFFFFFF)
+        return cc
+
+    def _located(
+        self,
+        ip_addr: Union[str, IPv4, ipaddress.IPv4Address, ipaddress.IPv6Address],
+        country_code: Optional[str],
+    ) -> Optional[Type["IPCountry"]]:
+        """A `private` method that returns an IPCountry (or a CompactIPCountry,
+        if GeoIP.compact_results) if there's a country code."""
+        if country_code:
+            if isinstance(ip_addr, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                ip_addr = ip_addr.compressed
+            return self._result_type(ip=ip_addr, country=get_country(country_code))
+
     def locate(
-        self, ip_addr: Union[str, IPv4, ipaddress.IPv4Address]
+        self,
+        ip_addr: Union[str, IPv4, ipaddress.IPv4Address, ipaddress.IPv6Address],
     ) -> Optional[Type["IPCountry"]]:
         """Returns an IPCountry (that is: an IP + a Country) based on an IP.
 
         Arguments:
-                ip_addr:str,IPv4,ipaddress.IPv4Address -> 190.10.22.63
+                ip_addr:str,IPv4,ipaddress.IPv4Address,ipaddress.IPv6Address -> 190.10.22.63
         Returns:
                 IPCountry(...)
         """
-        if isinstance(ip_addr, (IPv4, ipaddress.IPv4Address)):
-            ip_addr = ip_addr.compressed
+        # read before the index, so a reload can't leave old results in a new cache.
+        cache = self._locate_cache
+        if cache is None:
+            return self._located(ip_addr, self._find(ip_addr))
+
+        version, ip_int = ip_to_int(ip_addr)
+        key = ip_int if version == 4 else ip_int | 1 << 128
+        located = cache.get(key)
+        if located is LRUCache.MISSING:
+            located = self._located(ip_addr, self._find_int(version, ip_int))
+            cache.put(key, located)
+        elif located:
+            if isinstance(ip_addr, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+                ip_addr = ip_addr.compressed
+            if ip_addr != located.ip:
+                # same address, written differently (ie: 2001:db8:0::1 vs 2001:db8::1)
+                located = self._result_type(ip=ip_addr, country=located.country)
+        return located
 
-        f_octet = get_octet(ip_addr)
-        country_codes = self._query_cache("octet", f_octet)
-        if country_codes:
-            for cc in country_codes:
-                country_range = self.get_country_range(cc, f_octet)
-                if self.in_country_range(country_range, ip_addr):
-                    return IPCountry(ip=ip_addr, country=self.get_country(cc))
+    def cache_info(self) -> Optional[CacheInfo]:
+        """Returns the GeoIP.locate cache hits, misses and evictions (None if disabled).
+
+        Arguments:
+                ...
+        Returns:
+                CacheInfo(hits=..., misses=..., evictions=..., maxsize=..., currsize=...)
+        """
+        cache = self._locate_cache
+        if cache is not None:
+            return cache.cache_info()
 
     def locate_serialized(
         self, ip_addr: Union[str, IPv4, ipaddress.IPv4Address]
@@ -233,7 +921,7 @@ class GeoIP:
         located = self.locate(ip_addr)
         if located:
             serialized = located.asdict()
-        return json.dumps(serialized)
+        return json_dumps(serialized)
 
     def batch_locate(self, ip_addresses: list) -> Optional[List[Type["IPCountry"]]]:
         """Returns a list of IPCountry (that is: an IP + a Country) based on a list of IPs.
@@ -245,6 +933,92 @@ class GeoIP:
         """
         return [self.locate(ip_addr) for ip_addr in ip_addresses]
 
+    def batch_locate_parallel(
+        self,
+        ip_addresses: Iterable,
+        workers: Optional[int] = None,
+        chunk_size: int = 10000,
+    ) -> Generator:
+        """Multi-process version of GeoIP.batch_locate, for very large inputs.
+        Chunks of `ip_addresses` are located by a pool of `workers` processes, that
+        inherit the index (when processes can be forked) instead of receiving a copy.
+        Otherwise each worker loads GeoIP.geofile (compiled files are just `mmap`ed).
+        Only chunks being processed are kept in memory, results are yielded in order.
+
+        Arguments:
+                ip_addresses:Iterable[str,IPv4,ipaddress.IPv4Address] -> [1.2.3.4, 190.10.22.63, ...]
+                workers: int, Optional -> 32 (defaults to the number of CPUs)
+                chunk_size: int -> 10000
+        Returns:
+                Yields IPCountry(...) (or None), one per IP.
+        """
+        workers = workers or os.cpu_count()
+        if "fork" in multiprocessing.get_all_start_methods():
+            # forked processes inherit `self`, nothing gets pickled.
+            context = multiprocessing.get_context("fork")
+            initializer, initargs = _share_geoip, (self,)
+        else:
+            context = multiprocessing.get_context()
+            initializer, initargs = _load_geoip, (self.geofile, self.compact)
+
+        with ProcessPoolExecutor(
+            workers, mp_context=context, initializer=initializer, initargs=initargs
+        ) as pool:
+            pending = collections.deque()
+            for chunk in chunked(ip_addresses, chunk_size):
+                pending.append((chunk, pool.submit(_find_chunk, chunk)))
+                if len(pending) > workers * 2:
+                    chunk, future = pending.popleft()
+                    yield from map(self._located, chunk, future.result())
+            for chunk, future in pending:
+                yield from map(self._located, chunk, future.result())
+
+    def batch_locate_array(self, ip_addresses: Iterable) -> tuple:
+        """Vectorized batch lookup for large inputs. Requires numpy.
+        Only IPv4 ranges are searched (see GeoIP.batch_locate for IPv6 addresses).
+        Unlike GeoIP.batch_locate, doesn't build an IPCountry per IP, it returns
+        two arrays parallel to `ip_addresses`: the country indexes (-1 if the IP
+        couldn't be located) and the country codes ("" if the IP couldn't be located).
+        Integer arrays of other dtypes are accepted too, values out of the IPv4 range
+        (negative or >= 2**32) are not located.
+
+        Arguments:
+                ip_addresses:np.ndarray[uint32],Iterable[str] -> [1.2.3.4, 190.10.22.63, ...]
+        Returns:
+                (array([0, -1, ...], dtype=int32), array(["JP", "", ...]))
+        """
+        assert np is not None, ImportError("GeoIP.batch_locate_array requires numpy!")
+        if not isinstance(ip_addresses, np.ndarray):
+            ip_ints = np.frombuffer(ipv4s_to_ints(ip_addresses), dtype=np.uint32)
+            return self._parse.find_array(ip_ints)
+
+        assert ip_addresses.dtype.kind in "ui", ValueError(
+            f"Expected an array of integers, not {ip_addresses.dtype}"
+        )
+        if ip_addresses.dtype == np.uint32:
+            return self._parse.find_array(ip_addresses)
+        # casting would wrap them around (ie: -1 is 255.255.255.255).
+        out_of_range = (ip_addresses < 0) | (ip_addresses > 0xFFFFFFFF)
+        ip_ints = np.where(out_of_range, 0, ip_addresses).astype(np.uint32)
+        country_idx, country_codes = self._parse.find_array(ip_ints)
+        country_idx[out_of_range] = -1
+        country_codes[out_of_range] = ""
+        return country_idx, country_codes
+
+    def batch_locate_ndjson(
+        self, ip_addresses: Iterable, fobj: Union[TextIO, BinaryIO]
+    ) -> int:
+        """Streaming version of GeoIP.batch_locate_serialized, writes one JSON
+        document per located IP (NDJSON) as it goes.
+
+        Arguments:
+                ip_addresses:Iterable[str,IPv4,ipaddress.IPv4Address] -> [1.2.3.4, 190.10.22.63, ...]
+                fobj: TextIO,BinaryIO -> sys.stdout
+        Returns:
+                int (IPs located)
+        """
+        return write_ndjson(map(self.locate, ip_addresses), fobj)
+
     def batch_locate_serialized(self, ip_addresses: list) -> str:
         """Batch version of GeoIP.locate_serialized
 
@@ -257,4 +1031,42 @@ class GeoIP:
         located = self.batch_locate(ip_addresses)
         if located:
             serialized = [loc.asdict() for loc in located if loc]
-        return json.dumps(serialized)
+        return json_dumps(serialized)
+
+
+# GeoIP.batch_locate_parallel workers.
+_worker_geoip = None
+
+
+def count_overlaps(ranges: Iterable[Tuple[int, int, str]]) -> int:
+    """Returns how many ranges start before a previous one ended.
+
+    Arguments:
+        ranges: Iterable[Tuple[int, int, str]] -> [(16777216, 16842751, "AU"), ...]
+    Returns:
+        int
+    """
+    overlaps, last_end = 0, -1
+    for start, end, _ in sorted(ranges):
+        if start <= last_end:
+            overlaps += 1
+        last_end = max(last_end, end)
+    return overlaps
+
+
+def _share_geoip(geo: GeoIP) -> Literal[None]:
+    """Keeps the GeoIP inherited by a forked worker."""
+    global _worker_geoip
+    _worker_geoip = geo
+
+
+def _load_geoip(geofile: Path, compact: bool) -> Literal[None]:
+    """Loads a GeoIP in a (non forked) worker."""
+    global _worker_geoip
+    _worker_geoip = GeoIP(geofile, compact=compact)
+
+
+def _find_chunk(ip_addresses: list) -> list:
+    """Returns the country codes (or None) of a chunk of IPs.
+    Codes are cheaper to send back than IPCountry objects."""
+    return [_worker_geoip._find(ip_addr) for ip_addr in ip_addresses]
@@ -1,31 +1,56 @@
 #!/usr/bin/env python3
 
+import os
 import re
-import json
+import mmap
+import time
+import contextlib
 import ipaddress
 import functools
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List
+from typing import Iterable
+from typing import Optional
 from typing import Union
+from typing import TextIO
+from typing import BinaryIO
 from typing import Literal
 from typing import Generator
+from typing import Iterator
+from typing import Tuple
 
 from grait.utils import IPv4
+from grait.utils import IPv4Set
 from grait.utils import IPobject
+from grait.utils import CompactIPobject
+from grait.utils import IPGrabberCheckpoint
+from grait.utils import json_dumps
 from grait.utils import str_to_ipv4
+from grait.utils import write_ndjson
+from grait.utils import open_input
+from grait.utils import detect_compression
 
 class IPGrabber:
     """IPGrabber.
 
     Parses a plain text file and tries to grab every IPv4 address that can find.
+    Compressed files (gzip, bz2, xz, zstd) are decompressed on the fly.
+    IPGrabber.from_paths does the same on many files (concurrently) and merges the results.
 
     Arguments:
         ipfile (str, Path): A Path obj or a string that represents a path file.
+        compact (bool): Return (lightweight) CompactIPobjects instead of IPobjects.
+        engine (str): "lines" (default) reads the file line by line,
+                      "mmap" maps the file and scans it as a whole (faster on big files).
 
     Returns:
         [IPGrabber]: An IPGrabber objects.
         Provides two (cached) methods: IPGrabber.get_result and (JSON) IPGrabber.get_result_serialized
+        Plus IPGrabber.write_result_ndjson, to write the results as NDJSON,
+        and IPGrabber.iter_results, to scan (huge) files in bounded memory.
+        IPGrabber.iter_new and IPGrabber.follow scan growing (log) files incrementally.
     """
 
     # This regexp will catch anything from " 0.0.0.0 " to " 666.0.255.23 " (notice the \b's),
@@ -33,26 +58,320 @@ class IPGrabber:
     # Something to note is that it wont capture "10.1", which is a valid IP but
     # not a public IP, so we do not care for it.
     # At least for this particular (challenge) case.
+    # ASCII \b and \d (re.ASCII), so str and bytes (mmap) engines grab the same IPs.
     IP_REGEX = r"\b\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}\b"
+    IP_REGEX_COMPILED = re.compile(IP_REGEX, re.ASCII)
+    IP_REGEX_BYTES = re.compile(IP_REGEX.encode("ascii"), re.ASCII)
+    ENGINES = ("lines", "mmap")
+    # "255.255.255.255" plus the char needed to tell where a match ends (\b).
+    IP_MAX_LEN = 16
+    CHUNK_SIZE = 1 << 20
 
-    def __init__(self, ipfile: Union[str, Path]) -> Literal[None]:
+    def __init__(
+        self, ipfile: Union[str, Path], compact: bool = False, engine: str = "lines"
+    ) -> Literal[None]:
         self.ipfile = ipfile
+        self.compact = compact
+        self.engine = engine
+        assert self.engine in self.ENGINES, ValueError(
+            f"Unknown engine, expected one of: {', '.join(self.ENGINES)}"
+        )
         if not hasattr(self.ipfile, "exists"):
             self.ipfile = Path(self.ipfile)
         assert self.ipfile.exists(), FileNotFoundError("IP File doesn't exists!")
+        self.ipfiles = (self.ipfile,)
+        self.workers = 1
 
-    def _read(self) -> Generator:
-        """Opens a file and yields one line at a time.
+    @classmethod
+    def from_paths(
+        cls,
+        paths: Iterable[Union[str, Path]],
+        workers: Optional[int] = None,
+        compact: bool = False,
+        engine: str = "lines",
+    ) -> "IPGrabber":
+        """Returns an IPGrabber that scans many files and merges their results
+        (in `paths` order): one IP object per IP, counting every occurrence in every file.
+        Files are scanned concurrently by a pool of `workers` processes, which only
+        count what they grab; every distinct IP is then validated once.
+        first_line is a line number in the first file the IP was seen in,
+        last_line is a line number in the last one.
 
         Arguments:
-                ...
+                paths: Iterable[str,Path] -> ["access.log.1", "access.log.2", ...]
+                workers: int, Optional -> 32 (defaults to the number of CPUs)
+                compact: bool -> False (see IPGrabber)
+                engine: str -> "lines" (see IPGrabber)
+        Returns:
+                IPGrabber
+        """
+        paths = [path if hasattr(path, "exists") else Path(path) for path in paths]
+        assert paths, ValueError("No IP Files to grab from!")
+        for path in paths:
+            assert path.exists(), FileNotFoundError(f"IP File {path} doesn't exists!")
+        ipg = cls(paths[0], compact=compact, engine=engine)
+        ipg.ipfiles = tuple(paths)
+        ipg.workers = workers or os.cpu_count()
+        return ipg
+
+    def _read(self, ipfile: Optional[Path] = None) -> Generator:
+        """Opens a (maybe compressed, see utils.open_input) file and yields one line at a time.
+        Lines end at "\\n" only (the other engines count them that way), not at a bare "\\r".
+
+        Arguments:
+                ipfile: Path, Optional -> Path(...) (defaults to IPGrabber.ipfile)
         Returns:
                 Yields (stripped) lines.
         """
-        with open(self.ipfile, "r") as ipf:
+        with open_input(ipfile or self.ipfile, "r", newline="\n") as ipf:
             for line in ipf.readlines():
                 yield line.strip()
 
+    def _read_chunks(self, chunk_size: int, ipfile: Optional[Path] = None) -> Generator:
+        """Opens a (maybe compressed) file in binary mode and yields chunks of
+        (at most) chunk_size bytes.
+
+        Arguments:
+                chunk_size: int -> 1048576
+                ipfile: Path, Optional -> Path(...) (defaults to IPGrabber.ipfile)
+        Returns:
+                Yields bytes.
+        """
+        with open_input(ipfile or self.ipfile, "rb") as ipf:
+            while True:
+                chunk = ipf.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+
+    def _grab_ips_chunked(self, chunk_size: int, ipfile: Optional[Path] = None) -> Generator:
+        """Runs IPGrabber.IP_REGEX on the file, one chunk at a time.
+        IPs split across chunks are handled by carrying the last few bytes of
+        a chunk over to the next one: a match that starts IP_MAX_LEN bytes
+        (or less) before the end of a chunk could be incomplete, so it's
+        scanned again with the next chunk. One byte before the carried bytes is
+        kept as well, so \\b sees the same text it would see on the whole file.
+
+        Arguments:
+                chunk_size: int -> 1048576
+                ipfile: Path, Optional -> Path(...) (defaults to IPGrabber.ipfile)
+        Returns:
+                Yields bytes -> b"127.0.0.1", ...
+        """
+        regex = self.IP_REGEX_BYTES
+        buf = b""
+        pos = 0
+        for chunk in self._read_chunks(chunk_size, ipfile):
+            buf += chunk
+            limit = len(buf) - self.IP_MAX_LEN
+            end = pos
+            for match in regex.finditer(buf, pos):
+                if match.start() >= limit:
+                    break
+                end = match.end()
+                yield match.group()
+            carry = max(end, limit, pos)
+            buf = buf[carry - 1 :] if carry else buf
+            pos = 1 if carry else pos
+
+        for match in regex.finditer(buf, pos):
+            yield match.group()
+
+    def _ipobject(
+        self,
+        ip_: str,
+        ip: IPv4,
+        count: int = 1,
+        first_line: Optional[int] = None,
+        last_line: Optional[int] = None,
+    ) -> Union[IPobject, CompactIPobject]:
+        """Builds an IPobject (or a CompactIPobject, if IPGrabber.compact).
+
+        Arguments:
+                ip_: str -> "127.0.0.1"
+                ip: IPv4 -> IPv4("127.0.0.1")
+                count: int -> 1
+                first_line: int, Optional -> 1
+                last_line: int, Optional -> 1
+        Returns:
+                IPobject or CompactIPobject
+        """
+        if self.compact:
+            return CompactIPobject(int(ip), ip.is_global, count, first_line, last_line)
+        return IPobject(
+            **{
+                "ip": ip_,
+                "object": ip,
+                "is_valid": ip.is_global,
+                "count": count,
+                "first_line": first_line,
+                "last_line": last_line,
+            }
+        )
+
+    def iter_results(
+        self, chunk_size: int = CHUNK_SIZE, dedup: bool = True
+    ) -> Iterator[Union[IPobject, CompactIPobject]]:
+        """A streaming version of IPGrabber.get_result.
+        Reads the file(s) in fixed-size chunks and yields IP objects as soon as they're found,
+        memory stays bounded by chunk_size (plus the IPv4Set of seen IPs, if dedup).
+        IPs are yielded when first seen, so there are no counts nor line numbers here.
+        Anything that looks like an IP but isn't (ie: 666.0.255.23) is skipped.
+
+        Arguments:
+                chunk_size: int -> 1048576
+                dedup: bool -> True (yields the first time an IP is seen only)
+        Returns:
+                Yields IPobject or CompactIPobject (if IPGrabber.compact)
+        """
+        assert chunk_size > 0, ValueError("chunk_size must be a positive int")
+        # a few bytes per IP, see IPv4Set.
+        seen = IPv4Set()
+        ips = (
+            ip_
+            for ipfile in self.ipfiles
+            for ip_ in self._grab_ips_chunked(chunk_size, ipfile)
+        )
+        for ip_ in ips:
+            ip_ = ip_.decode("ascii")
+            try:
+                ip = str_to_ipv4(ip_)
+            except ipaddress.AddressValueError:
+                continue
+            if dedup and not seen.add(int(ip)):
+                continue
+            yield self._ipobject(ip_, ip)
+
+    def _read_appended(self, ipf: BinaryIO, chunk_size: int) -> Generator:
+        """Reads an (open) file from its current position, in chunks that end at
+        the end of a line: a line still being written is left for the next scan.
+
+        Arguments:
+                ipf: BinaryIO -> open("access.log", "rb")
+                chunk_size: int -> 1048576
+        Returns:
+                Yields bytes (whole lines).
+        """
+        pending = b""
+        for chunk in iter(functools.partial(ipf.read, chunk_size), b""):
+            pending += chunk
+            cut = pending.rfind(b"\n") + 1
+            if cut:
+                yield pending[:cut]
+                pending = pending[cut:]
+
+    def _scan_new(self, checkpoint: IPGrabberCheckpoint, chunk_size: int) -> Generator:
+        """Scans whatever was appended to IPGrabber.ipfile since `checkpoint`, which
+        gets updated (after every chunk) along the way.
+        If the file was rotated (another inode) or truncated it's scanned from the start.
+
+        Arguments:
+                checkpoint: IPGrabberCheckpoint -> IPGrabberCheckpoint(...)
+                chunk_size: int -> 1048576
+        Returns:
+                Yields IPobject or CompactIPobject (IPs not in checkpoint.seen)
+        """
+        stat = os.stat(self.ipfile)
+        if checkpoint.inode != stat.st_ino or checkpoint.offset > stat.st_size:
+            # seen IPs are kept, those were already emitted.
+            checkpoint.inode, checkpoint.offset, checkpoint.line = stat.st_ino, 0, 0
+        checkpoint.path = str(self.ipfile.resolve())
+        with open(self.ipfile, "rb") as ipf:
+            ipf.seek(checkpoint.offset)
+            for chunk in self._read_appended(ipf, chunk_size):
+                # chunks end with a "\n", no IP can be split between two of them.
+                lineno, pos = checkpoint.line + 1, 0
+                for match in self.IP_REGEX_BYTES.finditer(chunk):
+                    lineno += chunk.count(b"\n", pos, match.start())
+                    pos = match.start()
+                    ip_ = match.group().decode("ascii")
+                    try:
+                        ip = str_to_ipv4(ip_)
+                    except ipaddress.AddressValueError:
+                        continue
+                    if int(ip) in checkpoint.seen:
+                        continue
+                    checkpoint.seen.add(int(ip))
+                    yield self._ipobject(ip_, ip, first_line=lineno, last_line=lineno)
+                checkpoint.offset += len(chunk)
+                checkpoint.line += chunk.count(b"\n")
+
+    def _checkpoint(self, path: Optional[Union[str, Path]]) -> IPGrabberCheckpoint:
+        """Loads the checkpoint of an incremental scan (see IPGrabber.iter_new).
+
+        Arguments:
+                path: str,Path, Optional -> /var/lib/grait/access.log.checkpoint
+        Returns:
+                IPGrabberCheckpoint(...) (an empty one if path is None)
+        """
+        assert len(self.ipfiles) == 1, ValueError(
+            "Incremental scans work on a single file!"
+        )
+        assert detect_compression(self.ipfile) is None, ValueError(
+            f"{self.ipfile} is compressed, it can't be scanned incrementally!"
+        )
+        checkpoint = IPGrabberCheckpoint.load(path) if path else IPGrabberCheckpoint()
+        assert checkpoint.path in ("", str(self.ipfile.resolve())), ValueError(
+            f"The checkpoint belongs to {checkpoint.path}, not {self.ipfile}!"
+        )
+        return checkpoint
+
+    def iter_new(
+        self, checkpoint: Union[str, Path], chunk_size: int = CHUNK_SIZE
+    ) -> Iterator[Union[IPobject, CompactIPobject]]:
+        """Incremental version of IPGrabber.iter_results, for (growing) log files.
+        Scans only what was appended since the last run and yields only IPs that
+        weren't seen before (in any run). Where the scan stopped (byte offset,
+        inode and seen IPs) is saved to `checkpoint` (see IPGrabberCheckpoint),
+        also if the consumer stops early.
+        first_line (and last_line) are line numbers in the whole file.
+
+        Arguments:
+                checkpoint: str,Path -> /var/lib/grait/access.log.checkpoint
+                chunk_size: int -> 1048576
+        Returns:
+                Yields IPobject or CompactIPobject (if IPGrabber.compact)
+        """
+        assert chunk_size > 0, ValueError("chunk_size must be a positive int")
+        state = self._checkpoint(checkpoint)
+        try:
+            yield from self._scan_new(state, chunk_size)
+        finally:
+            state.save(checkpoint)
+
+    def follow(
+        self,
+        checkpoint: Optional[Union[str, Path]] = None,
+        interval: float = 1.0,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[Union[IPobject, CompactIPobject]]:
+        """Like `tail -f`: scans the file (from `checkpoint`, if any, otherwise from
+        the start), then keeps polling it every `interval` seconds, yielding new IPs
+        as they get appended. Rotated files are followed by name. Never returns.
+
+        Arguments:
+                checkpoint: str,Path, Optional -> /var/lib/grait/access.log.checkpoint
+                interval: float -> 1.0 (seconds)
+                chunk_size: int -> 1048576
+        Returns:
+                Yields IPobject or CompactIPobject (if IPGrabber.compact)
+        """
+        assert chunk_size > 0, ValueError("chunk_size must be a positive int")
+        state = self._checkpoint(checkpoint)
+        try:
+            while True:
+                try:
+                    yield from self._scan_new(state, chunk_size)
+                except FileNotFoundError:
+                    # rotated, but not re-created (yet).
+                    pass
+                if checkpoint:
+                    state.save(checkpoint)
+                time.sleep(interval)
+        finally:
+            if checkpoint:
+                state.save(checkpoint)
+
     def _grab_ips(self, line: str) -> List[str]:
         """Runs a re.findall on a string.
 
@@ -62,40 +381,179 @@ class IPGrabber:
         Returns:
                 list -> [] or ["127.0.0.1",...]
         """
-        return re.findall(self.IP_REGEX, line)
+        return self.IP_REGEX_COMPILED.findall(line)
+
+    @contextlib.contextmanager
+    def _mmap(self, ipfile: Optional[Path] = None) -> Generator:
+        """Maps the file in memory (read only). Compressed files can't be mapped.
+
+        Arguments:
+                ipfile: Path, Optional -> Path(...) (defaults to IPGrabber.ipfile)
+        Returns:
+                mmap.mmap or b"" (empty files can't be mapped)
+        """
+        ipfile = ipfile or self.ipfile
+        assert detect_compression(ipfile) is None, ValueError(
+            f"{ipfile} is compressed, it can't be mapped!"
+        )
+        with open(ipfile, "rb") as ipf:
+            try:
+                mapping = mmap.mmap(ipf.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                yield b""
+                return
+            with mapping:
+                yield mapping
+
+    def iter_matches(self) -> Iterator[Tuple[int, bytes]]:
+        """Maps the file in memory and runs IPGrabber.IP_REGEX over the whole mapping.
+        No decoding, no line splitting: the regex runs on the (raw) bytes.
+
+        Arguments:
+                ...
+        Returns:
+                Yields (offset, ip) -> (0, b"127.0.0.1"), ...
+        """
+        with self._mmap() as mapping:
+            for match in self.IP_REGEX_BYTES.finditer(mapping):
+                yield match.start(), match.group()
+
+    def _grab_all_ips(self, ipfile: Optional[Path] = None) -> Generator:
+        """Yields every IP-like string in the file (and its line number),
+        using IPGrabber.engine. Compressed files are always read line by line.
+
+        Arguments:
+                ipfile: Path, Optional -> Path(...) (defaults to IPGrabber.ipfile)
+        Returns:
+                Yields (line number, str) -> (1, "127.0.0.1"), ...
+        """
+        if self.engine == "mmap" and detect_compression(ipfile or self.ipfile) is None:
+            with self._mmap(ipfile) as mapping:
+                lineno, offset = 1, 0
+                for match in self.IP_REGEX_BYTES.finditer(mapping):
+                    # (mmap has no .count) slicing copies the gap between matches only.
+                    lineno += mapping[offset : match.start()].count(b"\n")
+                    offset = match.start()
+                    yield lineno, match.group().decode("ascii")
+            return
+        for lineno, line in enumerate(self._read(ipfile), 1):
+            for ip_ in self._grab_ips(line):
+                yield lineno, ip_
+
+    def _count(self, ipfile: Optional[Path] = None) -> dict:
+        """Counts every IP-like string in a file, nothing gets validated here.
+
+        Arguments:
+                ipfile: Path, Optional -> Path(...) (defaults to IPGrabber.ipfile)
+        Returns:
+                dict -> {"127.0.0.1": [count, first line, last line], ...}
+        """
+        counts = {}
+        for lineno, ip_ in self._grab_all_ips(ipfile):
+            seen = counts.get(ip_)
+            if seen is None:
+                counts[ip_] = [1, lineno, lineno]
+                continue
+            seen[0] += 1
+            seen[2] = lineno
+        return counts
+
+    def _count_all(self) -> dict:
+        """Counts every IP-like string in IPGrabber.ipfiles, in a pool of
+        IPGrabber.workers processes if there's more than one file (and worker).
+        Per file counts are merged in IPGrabber.ipfiles order.
+
+        Arguments:
+                ...
+        Returns:
+                dict -> {"127.0.0.1": [count, first line, last line], ...}
+        """
+        workers = min(self.workers, len(self.ipfiles))
+        if workers < 2:
+            return _merge_counts(map(self._count, self.ipfiles))
+        with ProcessPoolExecutor(workers) as pool:
+            return _merge_counts(
+                pool.map(_count_file, self.ipfiles, [self.engine] * len(self.ipfiles))
+            )
 
     @functools.lru_cache()
     def _parse(self) -> tuple:
         """Does the actual text/ip parsing.
-        Reads each line that IPGrabber._read() yields, grabs the IPs and
-        converts them to IPv4 object in order to validate them.
-        Finally builds a nice dict with the data.
+        Counts the IPs (see IPGrabber._count_all), then each distinct IP is
+        converted to an IPv4 object in order to validate it (just once).
+        Anything that looks like an IP but isn't (ie: 666.0.255.23) is skipped.
+        Finally builds a nice tuple with the data.
 
         Arguments:
                 ...
         Returns:
-                dict -> {ip: IP object, ...}
+                tuple -> (IP object, ...)
         """
-        ips = {}
-        for line in self._read():
-            for ip_ in self._grab_ips(line):
+        ips = []
+        # str keys are fine: a valid IP has a single (canonical) string form.
+        for ip_, (count, first_line, last_line) in self._count_all().items():
+            try:
                 ip = str_to_ipv4(ip_)
-                if ip_ in list(ips.keys()):
-                    continue
-                ips.update(
-                    {
-                        ip_: IPobject(
-                            **{"ip": ip_, "object": ip, "is_valid": ip.is_global}
-                        )
-                    }
-                )
-
-        return tuple(ipobject for ip_, ipobject in ips.items())
+            except ipaddress.AddressValueError:
+                continue
+            ips.append(self._ipobject(ip_, ip, count, first_line, last_line))
+
+        return tuple(ips)
 
     def get_result(self) -> tuple:
         """Returns IPGrabber._parse()"""
         return self._parse()
 
-    def get_result_serialized(self) -> str:
-        """A (JSON) serialized version of IPGrabber.get_result"""
-        return json.dumps([row.asdict() for row in self.get_result()])
+    def get_result_serialized(self, fields: Optional[Iterable[str]] = None) -> str:
+        """A (JSON) serialized version of IPGrabber.get_result.
+        Only the IPv4 `fields` asked for are computed (see IPv4.asdict).
+
+        Arguments:
+                fields: Iterable[str], Optional -> ["compressed", "is_global"] (defaults to all)
+        Returns:
+                str
+        """
+        return json_dumps([row.asdict(fields) for row in self.get_result()])
+
+    def write_result_ndjson(
+        self, fobj: Union[TextIO, BinaryIO], fields: Optional[Iterable[str]] = None
+    ) -> int:
+        """A streaming (NDJSON) version of IPGrabber.get_result_serialized,
+        writes one JSON document per IP.
+
+        Arguments:
+                fobj: TextIO,BinaryIO -> sys.stdout
+                fields: Iterable[str], Optional -> ["compressed", "is_global"] (defaults to all)
+        Returns:
+                int (IPs written)
+        """
+        return write_ndjson((row.asdict(fields) for row in self.get_result()), fobj)
+
+
+def _merge_counts(counts: Iterable[dict]) -> dict:
+    """Merges (in order) the results of IPGrabber._count.
+
+    Arguments:
+            counts: Iterable[dict] -> [{"127.0.0.1": [2, 1, 5]}, {"127.0.0.1": [1, 3, 3]}]
+    Returns:
+            dict -> {"127.0.0.1": [3, 1, 3]}
+    """
+    merged = {}
+    for file_counts in counts:
+        if not merged:
+            merged = file_counts
+            continue
+        for ip_, (count, first_line, last_line) in file_counts.items():
+            seen = merged.get(ip_)
+            if seen is None:
+                merged[ip_] = [count, first_line, last_line]
+                continue
+            seen[0] += count
+            seen[2] = last_line
+    return merged
+
+
+# IPGrabber.from_paths workers.
+def _count_file(ipfile: Path, engine: str) -> dict:
+    """Counts the IP-like strings in a file (see IPGrabber._count)."""
+    return IPGrabber(ipfile, engine=engine)._count()
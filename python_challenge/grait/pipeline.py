@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Any
+from typing import List
+from typing import Union
+from typing import TextIO
+from typing import BinaryIO
+from typing import Literal
+from typing import Callable
+from typing import Optional
+from typing import Iterable
+from typing import Generator
+
+import requests
+
+from .geoip import GeoIP
+from .rdap import RDAP
+from .grabber import IPGrabber
+from .utils import chunked
+from .utils import write_ndjson
+
+# Marks the end of a stage's output.
+_DONE = object()
+
+
+class Pipeline:
+    """Pipeline.
+
+    Grabs IPs (IPGrabber.iter_results), locates them (GeoIP) and, optionally,
+    looks up their RDAP info (RDAP). Each stage runs in its own thread and passes
+    batches of IPs to the next one through a bounded queue: a slow stage blocks
+    the ones before it (backpressure), so memory stays constant no matter how big
+    the input is (except for IPGrabber's set of seen IPs, see `dedup`).
+
+    Arguments:
+        ipgrabber: IPGrabber -> IPGrabber("access.log")
+        geoip: GeoIP -> GeoIP("GeoIPCountryWhois.bin")
+        rdap: RDAP, Optional -> RDAP() (defaults to None, no RDAP lookups)
+        batch_size: int -> 1000 (IPs per batch)
+        queue_size: int -> 4 (batches waiting between two stages)
+        rdap_workers: int -> 8 (concurrent RDAP lookups)
+        dedup: bool -> True (see IPGrabber.iter_results)
+
+    Returns:
+        [Pipeline]: A Pipeline object.
+        Pipeline.run yields one record (dict) per IP, in the order they were grabbed,
+        Pipeline.write_ndjson writes them as NDJSON.
+        {"ip": "N.N.N.N", "is_valid": True, "country": {...} or None, "rdap": {...} or None}
+        ("rdap" only if there's an RDAP stage, lookups are done for valid IPs only).
+    """
+
+    def __init__(
+        self,
+        ipgrabber: IPGrabber,
+        geoip: GeoIP,
+        rdap: Optional[RDAP] = None,
+        batch_size: int = 1000,
+        queue_size: int = 4,
+        rdap_workers: int = 8,
+        dedup: bool = True,
+    ) -> Literal[None]:
+        assert batch_size > 0, ValueError("batch_size must be a positive int")
+        assert queue_size > 0, ValueError("queue_size must be a positive int")
+        self.ipgrabber = ipgrabber
+        self.geoip = geoip
+        self.rdap = rdap
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.rdap_workers = rdap_workers
+        self.dedup = dedup
+
+    def _locate(self, ipobjects: list) -> List[dict]:
+        """GeoIP stage: builds a record per IP.
+
+        Arguments:
+                ipobjects: List[IPobject,CompactIPobject] -> [IPobject(...), ...]
+        Returns:
+                [{"ip": "N.N.N.N", "is_valid": True, "country": {...}}, ...]
+        """
+        located = self.geoip.batch_locate([ipobject.ip for ipobject in ipobjects])
+        return [
+            {
+                "ip": ipobject.ip,
+                "is_valid": ipobject.is_valid,
+                "country": located_.asdict()["country"] if located_ else None,
+            }
+            for ipobject, located_ in zip(ipobjects, located)
+        ]
+
+    def _lookup(self, record: dict) -> dict:
+        """Adds the RDAP info of an IP to its record. Failed lookups (network errors,
+        malformed responses) are just None.
+
+        Arguments:
+                record: dict -> {"ip": "N.N.N.N", "is_valid": True, ...}
+        Returns:
+                {"ip": "N.N.N.N", "is_valid": True, ..., "rdap": {...}}
+        """
+        response = None
+        if record["is_valid"]:
+            try:
+                response = self.rdap.lookup(record["ip"])
+            except (requests.RequestException, ValueError):
+                pass
+        record["rdap"] = response.asdict() if response else None
+        return record
+
+    def _stages(self, pool: Optional[ThreadPoolExecutor]) -> List[Callable]:
+        """Returns the functions applied to each batch, one per stage (after grabbing).
+
+        Arguments:
+                pool: ThreadPoolExecutor, Optional -> ThreadPoolExecutor(...)
+        Returns:
+                [Pipeline._locate, ...]
+        """
+        stages = [self._locate]
+        if self.rdap is not None:
+            stages.append(lambda records: list(pool.map(self._lookup, records)))
+        return stages
+
+    def run(self) -> Generator:
+        """Runs the pipeline, yielding records as they get out of the last stage.
+        Closing the generator early stops every stage.
+
+        Arguments:
+                ...
+        Returns:
+                Yields {"ip": "N.N.N.N", "is_valid": True, "country": {...}, ...}
+        """
+        stop = threading.Event()
+        pool = None
+        if self.rdap is not None:
+            pool = ThreadPoolExecutor(self.rdap_workers)
+
+        batches = chunked(self.ipgrabber.iter_results(dedup=self.dedup), self.batch_size)
+        inbox = queue.Queue(self.queue_size)
+        threads = [threading.Thread(target=_source, args=(batches, inbox, stop))]
+        for stage in self._stages(pool):
+            outbox = queue.Queue(self.queue_size)
+            threads.append(
+                threading.Thread(target=_stage, args=(stage, inbox, outbox, stop))
+            )
+            inbox = outbox
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        try:
+            while True:
+                batch = inbox.get()
+                if batch is _DONE:
+                    break
+                if isinstance(batch, BaseException):
+                    raise batch
+                yield from batch
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            if pool is not None:
+                pool.shutdown()
+
+    def write_ndjson(self, fobj: Union[TextIO, BinaryIO]) -> int:
+        """Runs the pipeline, writing one JSON document per IP.
+
+        Arguments:
+                fobj: TextIO,BinaryIO -> sys.stdout
+        Returns:
+                int (records written)
+        """
+        return write_ndjson(self.run(), fobj)
+
+
+def _put(outbox: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Queues `item` (waiting while `outbox` is full), unless the pipeline stops."""
+    while not stop.is_set():
+        try:
+            outbox.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _source(batches: Iterable, outbox: queue.Queue, stop: threading.Event) -> Literal[None]:
+    """First stage: queues batches of grabbed IPs. Errors are passed downstream."""
+    try:
+        for batch in batches:
+            if not _put(outbox, batch, stop):
+                return
+    except Exception as e:
+        _put(outbox, e, stop)
+        return
+    _put(outbox, _DONE, stop)
+
+
+def _stage(
+    func: Callable, inbox: queue.Queue, outbox: queue.Queue, stop: threading.Event
+) -> Literal[None]:
+    """Applies `func` to every batch in `inbox`, queues the results in `outbox`."""
+    while not stop.is_set():
+        try:
+            batch = inbox.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        if batch is _DONE or isinstance(batch, BaseException):
+            _put(outbox, batch, stop)
+            return
+        try:
+            batch = func(batch)
+        except Exception as e:
+            _put(outbox, e, stop)
+            return
+        if not _put(outbox, batch, stop):
+            return
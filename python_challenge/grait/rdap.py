@@ -1,18 +1,186 @@
 #!/usr/bin/env python3
 
+import os
 import json
-import functools
+import time
+import bisect
+import asyncio
+import sqlite3
+import ipaddress
+import threading
 
 import requests
 
+from concurrent.futures import ThreadPoolExecutor
+
 from typing import List
 from typing import Type
+from typing import Union
+from typing import TextIO
+from typing import BinaryIO
 from typing import Literal
+from typing import Iterable
 from typing import Optional
+from typing import Tuple
+from typing import AsyncGenerator
+from typing import Any
+
+from pathlib import Path
 
-from .utils import get_octet
+from .utils import json_dumps
+from .utils import ipv4_to_int
+from .utils import write_ndjson
 from .utils import RDAPService
 from .utils import RDAPResponse
+from .utils import CompactRDAPResponse
+from .utils import TokenBucket
+from .utils import PrefixTable
+from .utils import http_get
+from .utils import make_session
+
+
+class RDAPCache:
+    """RDAPCache.
+
+    A persistent (SQLite) cache of RDAP responses. An RDAP response describes a whole
+    network (startAddress - endAddress), so it's stored once, keyed by that range,
+    and answers for any IP inside of it. Failed lookups are cached too (negative
+    entries, keyed by the IP), for a shorter time. The network sizes in the cache
+    are read when it's opened, entries other processes add with new sizes are
+    only seen after reopening it.
+
+    Arguments:
+        path: str,Path -> "~/.cache/grait/rdap.sqlite" (defaults to ":memory:")
+        ttl: float -> 604800 (seconds a response is valid)
+        negative_ttl: float -> 3600 (seconds a failed lookup is valid)
+
+    Returns:
+        [RDAPCache]: An RDAPCache object, see RDAPCache.get and RDAPCache.put
+    """
+
+    MISSING = object()
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS rdap ("
+        "start INTEGER NOT NULL, end INTEGER NOT NULL, expires REAL NOT NULL, data TEXT, "
+        "PRIMARY KEY (start, end))"
+    )
+    # networks of the same size (span), by start: see RDAPCache.get.
+    INDEX = "CREATE INDEX IF NOT EXISTS rdap_span ON rdap (end - start, start)"
+
+    def __init__(
+        self,
+        path: Union[str, Path] = ":memory:",
+        ttl: float = 7 * 24 * 3600,
+        negative_ttl: float = 3600,
+    ) -> Literal[None]:
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # used from RDAP.lookup callers' threads, every access holds the lock.
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(self.SCHEMA)
+            self._db.execute(self.INDEX)
+        self._spans = self._load_spans()
+
+    def _load_spans(self) -> List[int]:
+        """Returns the (sorted) network sizes in the cache (end - start).
+
+        Arguments:
+                ...
+        Returns:
+                [0, 255, 65535, ...]
+        """
+        with self._lock:
+            return [
+                row[0]
+                for row in self._db.execute("SELECT DISTINCT end - start FROM rdap ORDER BY 1")
+            ]
+
+    def get(self, ip_addr: str) -> Any:
+        """Returns the (raw) RDAP response of the narrowest, not expired, network
+        that contains `ip_addr`. Networks are looked up by size, narrowest first: one
+        indexed search per size (there are a few, /24s, /16s, ...), however big the cache is.
+
+        Arguments:
+                ip_addr: str -> 190.2.3.4
+        Returns:
+                {...}, None (a cached failed lookup) or RDAPCache.MISSING
+        """
+        ip_int = ipv4_to_int(ip_addr)
+        now = time.time()
+        with self._lock:
+            for span in self._spans:
+                row = self._db.execute(
+                    "SELECT data FROM rdap WHERE end - start = ? AND start BETWEEN ? AND ? "
+                    "AND expires > ? ORDER BY start DESC LIMIT 1",
+                    (span, ip_int - span, ip_int, now),
+                ).fetchone()
+                if row is not None:
+                    return json.loads(row[0]) if row[0] is not None else None
+        return self.MISSING
+
+    def put(self, ip_addr: str, data: Optional[dict]) -> Literal[None]:
+        """Caches the (raw) RDAP response of `ip_addr`, by its network range
+        (or just the IP, if there's no usable range or no response at all).
+
+        Arguments:
+                ip_addr: str -> 190.2.3.4
+                data: dict, Optional -> {"startAddress": "190.0.0.0", ...} or None
+        Returns:
+                ...
+        """
+        start = end = ip_int = ipv4_to_int(ip_addr)
+        if data is not None:
+            try:
+                start = ipv4_to_int(data.get("startAddress", ""))
+                end = ipv4_to_int(data.get("endAddress", ""))
+            except ValueError:
+                start = end = ip_int
+            if not start <= ip_int <= end:
+                start = end = ip_int
+        ttl = self.ttl if data is not None else self.negative_ttl
+        with self._lock, self._db:
+            if end - start not in self._spans:
+                bisect.insort(self._spans, end - start)
+            self._db.execute(
+                "INSERT OR REPLACE INTO rdap (start, end, expires, data) VALUES (?, ?, ?, ?)",
+                (
+                    start,
+                    end,
+                    time.time() + ttl,
+                    json_dumps(data) if data is not None else None,
+                ),
+            )
+
+    def purge(self) -> int:
+        """Deletes expired entries.
+
+        Arguments:
+                ...
+        Returns:
+                int (entries deleted)
+        """
+        with self._lock, self._db:
+            return self._db.execute(
+                "DELETE FROM rdap WHERE expires <= ?", (time.time(),)
+            ).rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM rdap").fetchone()[0]
+
+    def close(self) -> Literal[None]:
+        """Closes the database."""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self) -> "RDAPCache":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> Literal[None]:
+        self.close()
 
 
 class RDAP:
@@ -22,56 +190,196 @@ class RDAP:
     Each one of these services can query their servers for an IP RDAP info.
 
     Arguments:
-        ...
+        cache: RDAPCache,str,Path, Optional -> RDAPCache(...) or a path to one (defaults to None)
+        bootstrap: str,Path, Optional -> "tests/test_data/iana_rdap_ipv4.json" (an URL or
+            a local file, defaults to RDAP.IPV4_ALLOC)
+        bootstrap_cache: str,Path, Optional -> "/tmp/iana_rdap_ipv4.json" (where a downloaded
+            bootstrap file is saved, defaults to RDAP.BOOTSTRAP_CACHE)
+        refresh_after: float -> 86400 (seconds before a saved bootstrap file is refreshed)
+        compact: bool -> False (return lightweight CompactRDAPResponses instead of RDAPResponses)
 
     Returns:
         [RDAP]: An RDAP objects.
         Provides many methods:
 
     RDAP.get_services: Returns `RDAPService`s.
-    RDAP.find_service: Returns a `RDAPService` based on the first octet.
+    RDAP.refresh_bootstrap: Downloads the IANA bootstrap file again, if it changed.
+    RDAP.find_service: Returns the `RDAPService` of an IP (longest prefix match).
     RDAP.lookup: Lookups an IP RDAP info.
     RDAP.lookup_serialized: Serialized version of RDAP.lookup.
     RDAP.batch_lookup: Batch version of RDAP.lookup
     RDAP.batch_lookup_serialized: Batch version of RDAP.lookup_serialized
+    RDAP.batch_lookup_ndjson: Streaming (NDJSON) version of RDAP.batch_lookup_serialized
+    RDAP.abatch_lookup: Concurrent (asyncio) version of RDAP.batch_lookup, rate limited per service
     """
 
     IPV4_ALLOC = "https://data.iana.org/rdap/ipv4.json"
-
-    def __init__(self) -> Literal[None]:
+    BOOTSTRAP_CACHE = (
+        Path(os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache")
+        / "grait"
+        / "iana_rdap_ipv4.json"
+    )
+
+    def __init__(
+        self,
+        cache: Optional[Union[RDAPCache, str, Path]] = None,
+        bootstrap: Optional[Union[str, Path]] = None,
+        bootstrap_cache: Optional[Union[str, Path]] = None,
+        refresh_after: float = 24 * 3600,
+        compact: bool = False,
+    ) -> Literal[None]:
         self._ipv4_json = None
+        self._services = self._services_json = self._prefixes = None
+        self._bootstrap_meta = {}
+        self._refresh_thread = None
+        self.cache = cache
+        if cache is not None and not isinstance(cache, RDAPCache):
+            self.cache = RDAPCache(cache)
+        self.bootstrap = bootstrap or self.IPV4_ALLOC
+        self.bootstrap_cache = Path(bootstrap_cache or self.BOOTSTRAP_CACHE)
+        self.refresh_after = refresh_after
+        self.compact = compact
+        self._result_type = CompactRDAPResponse if compact else RDAPResponse
         self._get_ipv4_json()
 
-    @functools.lru_cache()
+    def _is_local_bootstrap(self) -> bool:
+        """Whether the bootstrap file is a local one (a path, not an URL)."""
+        return isinstance(self.bootstrap, Path) or "://" not in self.bootstrap
+
     def _get_ipv4_json(self) -> dict:
-        """Returns iana.org IPv4 RDAP info.
+        """Returns the IANA IPv4 RDAP bootstrap file. A local one is just read, an
+        URL is read from its saved copy (RDAP.bootstrap_cache) and refreshed in the
+        background once it's older than RDAP.refresh_after. Only the first run, with
+        nothing saved yet, waits for the download.
 
         Arguments:
                 ...
         Returns:
-                Response(...)
+                {"publication": "...", "services": [...], ...}
         """
         if self._ipv4_json:
             return self._ipv4_json
 
-        response = requests.get(self.IPV4_ALLOC)
-        if response.ok:
-            self._ipv4_json = response.json()
+        if self._is_local_bootstrap():
+            with open(self.bootstrap, "r") as ipv4_io:
+                self._ipv4_json = json.load(ipv4_io)
+            return self._ipv4_json
+
+        saved = self._load_bootstrap()
+        if saved is None:
+            self.refresh_bootstrap()
+        else:
+            self._ipv4_json = saved.pop("data")
+            self._bootstrap_meta = saved
+            if time.time() - saved.get("fetched", 0) >= self.refresh_after:
+                self._refresh_thread = threading.Thread(
+                    target=self._refresh_quietly, daemon=True
+                )
+                self._refresh_thread.start()
+        return self._ipv4_json
+
+    def _load_bootstrap(self) -> Optional[dict]:
+        """Returns the saved copy of the bootstrap file, if it's from RDAP.bootstrap.
+
+        Arguments:
+                ...
+        Returns:
+                {"url": "...", "data": {...}, "etag": "...", "last_modified": "...",
+                 "publication": "...", "fetched": 1560000000.0} or None
+        """
+        try:
+            saved = json.loads(self.bootstrap_cache.read_text())
+        except (OSError, ValueError):
+            return None
+        if saved.get("url") != self.bootstrap or not saved.get("data"):
+            return None
+        return saved
+
+    def _save_bootstrap(self) -> Literal[None]:
+        """Saves the bootstrap file (and its validators), atomically.
+        Not being able to save it is not an error, it's just downloaded next time.
+
+        Arguments:
+                ...
+        Returns:
+                ...
+        """
+        saved = dict(self._bootstrap_meta, url=self.bootstrap, data=self._ipv4_json)
+        tmp_path = self.bootstrap_cache.with_name(f"{self.bootstrap_cache.name}.tmp")
+        try:
+            self.bootstrap_cache.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_text(json_dumps(saved))
+            os.replace(tmp_path, self.bootstrap_cache)
+        except OSError:
+            pass
+
+    def refresh_bootstrap(self) -> bool:
+        """Downloads the bootstrap file again, if it changed (a conditional GET, with
+        the ETag and Last-Modified of the current one), and saves it.
+        Services are rebuilt from the new file the next time they're needed.
+
+        Arguments:
+                ...
+        Returns:
+                bool (True if there's a new bootstrap file)
+        """
+        if self._is_local_bootstrap():
+            return False
+
+        headers = {}
+        if self._ipv4_json and self._bootstrap_meta.get("etag"):
+            headers["If-None-Match"] = self._bootstrap_meta["etag"]
+        if self._ipv4_json and self._bootstrap_meta.get("last_modified"):
+            headers["If-Modified-Since"] = self._bootstrap_meta["last_modified"]
+        response = http_get(self.bootstrap, headers=headers)
+        if response.status_code == 304:
+            self._bootstrap_meta["fetched"] = time.time()
+            self._save_bootstrap()
+            return False
+        if not response.ok:
+            return False
+
+        ipv4_json = response.json()
+        self._bootstrap_meta = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "publication": ipv4_json.get("publication"),
+            "fetched": time.time(),
+        }
+        # a new dict, see RDAP._get_services.
+        self._ipv4_json = ipv4_json
+        self._save_bootstrap()
+        return True
+
+    def _refresh_quietly(self) -> Literal[None]:
+        """RDAP.refresh_bootstrap, for the background: there's a saved copy to use
+        until the next run if the network is down."""
+        try:
+            self.refresh_bootstrap()
+        except (requests.RequestException, ValueError):
+            pass
 
     def _get_services(self) -> dict:
-        """Requests the IANA for RDAP Services and their ranges.
+        """Builds the RDAP Services (and their ranges) from the IANA bootstrap file,
+        along with a PrefixTable of their ranges (see RDAP.find_service).
+        Both are built once per bootstrap file (and rebuilt if it's replaced).
 
         Arguments:
                 ...
         Returns:
                 {service: RDAPService(...), ...}
         """
-        services = {}
         ipv4_json = self._ipv4_json
+        if self._services is not None and self._services_json is ipv4_json:
+            return self._services
+
+        services = {}
         publication_date = ipv4_json.get("publication")
         for ranges, service in ipv4_json.get("services"):
-            service = [reg for reg in service if reg.startswith("https://")]
-            service = service.pop(0)
+            # https, if the registry has it.
+            service = ([reg for reg in service if reg.startswith("https://")] or service)[0]
+            if service in services:
+                ranges = services[service].ranges + ranges
             services.update(
                 {
                     service: RDAPService(
@@ -82,6 +390,13 @@ class RDAP:
                 }
             )
 
+        prefixes = PrefixTable()
+        for service in services.values():
+            for range_ in service.ranges:
+                prefixes.add(range_, service)
+
+        self._prefixes = prefixes
+        self._services, self._services_json = services, ipv4_json
         return services
 
     def get_services(self) -> dict:
@@ -104,47 +419,91 @@ class RDAP:
         """
         return self._get_services().get(domain, None)
 
-    def find_service(self, octet: str) -> Optional[Type["RDAPService"]]:
-        """Returns a single Service based if the first octet matches with any of its first_octets.
+    def find_service(self, ip_addr: str) -> Optional[Type["RDAPService"]]:
+        """Returns the Service with the longest (most specific) range holding `ip_addr`.
+        A first octet (ie: "190") is looked up as the first IP of its /8 ("190.0.0.0").
 
         Arguments:
-                octet: str -> 190
+                ip_addr: str -> 190.2.3.4 or 190
         Returns:
-                RDAPService(...)
+                RDAPService(...) or None (also if `ip_addr` is not an IPv4)
         """
-        services = [
-            service
-            for domain, service in self.get_services().items()
-            if octet in service.first_octets
-        ]
-        if services:
-            return services.pop(0)
-
-    def _query_service(
-        self, service: Type["RDAPService"], ip_addr: str
-    ) -> Optional[Type["RDAPResponse"]]:
+        self._get_services()
+        if ip_addr.isdigit():
+            return self._prefixes.get(int(ip_addr) << 24) if int(ip_addr) < 256 else None
+        try:
+            return self._prefixes.get(ip_addr)
+        except ipaddress.AddressValueError:
+            return None
+
+    @staticmethod
+    def _is_ipv4(ip_addr: str) -> bool:
+        """Whether `ip_addr` is an IPv4 (IPv6 addresses can't be looked up)."""
+        try:
+            ipv4_to_int(ip_addr)
+        except ipaddress.AddressValueError:
+            return False
+        return True
+
+    def _query_service(self, service: Type["RDAPService"], ip_addr: str) -> Any:
         """Returns the actual RDAP request to get an IP RDAP info.
 
         Arguments:
                 service: RDAPService -> RDAPService(...)
                 ip_addr: str -> 190.2.3.4
         Returns:
-                RDAPResponse(...)
+                {...} (the raw RDAP response), None or RDAPCache.MISSING
+                (not worth caching, see RDAPService.response_data)
+        """
+        return service.query_ip_data(ip_addr, retry_later=RDAPCache.MISSING)
+
+    def _cached(self, ip_addr: str) -> Any:
+        """Returns the cached (raw) RDAP response of an IP (see RDAPCache.get).
+
+        Arguments:
+                ip_addr: str -> 190.2.3.4
+        Returns:
+                {...}, None or RDAPCache.MISSING
+        """
+        if self.cache is None:
+            return RDAPCache.MISSING
+        return self.cache.get(ip_addr)
+
+    def _response(self, ip_addr: str, data: Any) -> Optional[Type["RDAPResponse"]]:
+        """Caches a (raw) RDAP response, if there's a cache, and builds an RDAPResponse.
+        Failures worth retrying (RDAPCache.MISSING, see RDAPService.response_data) are not cached.
+
+        Arguments:
+                ip_addr: str -> 190.2.3.4
+                data: dict, Optional -> {...}, None or RDAPCache.MISSING
+        Returns:
+                RDAPResponse(...) or None
         """
-        return service.query_ip(ip_addr)
+        if data is RDAPCache.MISSING:
+            return None
+        if self.cache is not None:
+            self.cache.put(ip_addr, data)
+        if data is not None:
+            return self._result_type(data=data)
 
     def lookup(self, ip_addr: str) -> Optional[Type["RDAPResponse"]]:
         """Finds the correct RDAPService and will perform a RDAP request with RDAP._query_service.
+        If there's a cache (see RDAPCache), it's asked first.
 
         Arguments:
                 ip_addr: str -> 190.2.3.4
         Returns:
-                RDAPResponse(...)
+                RDAPResponse(...) or None (also if `ip_addr` is not an IPv4)
         """
-        octet = get_octet(ip_addr)
-        service = self.find_service(octet)
+        if not self._is_ipv4(ip_addr):
+            return None
+        data = self._cached(ip_addr)
+        if data is not RDAPCache.MISSING:
+            return self._result_type(data=data) if data is not None else None
+        service = self.find_service(ip_addr)
         if service:
-            return self._query_service(service, ip_addr)
+            return self._response(ip_addr, self._query_service(service, ip_addr))
+        return self._response(ip_addr, None)
 
     def lookup_serialized(self, ip_addr: str) -> str:
         """Serialized version of RDAP.lookup
@@ -154,8 +513,11 @@ class RDAP:
         Returns:
                 {...}
         """
-        who_ = self.lookup(ip_addr).asdict()
-        return json.dumps(who_)
+        who_ = {}
+        looked_up = self.lookup(ip_addr)
+        if looked_up:
+            who_ = looked_up.asdict()
+        return json_dumps(who_)
 
     def batch_lookup(self, ip_addresses: list) -> List[Optional[Type["RDAPResponse"]]]:
         """Batch version of RDAP.lookup.
@@ -178,5 +540,131 @@ class RDAP:
         serialized = {}
         lookups = self.batch_lookup(ip_addresses)
         if lookups:
-            serialized = [lu.asdict() for lu in lookups]
-        return json.dumps(serialized)
+            serialized = [lu.asdict() for lu in lookups if lu]
+        return json_dumps(serialized)
+
+    def batch_lookup_ndjson(
+        self, ip_addresses: Iterable[str], fobj: Union[TextIO, BinaryIO]
+    ) -> int:
+        """Streaming (NDJSON) version of RDAP.batch_lookup_serialized,
+        writes one JSON document per lookup as it goes.
+
+        Arguments:
+                ip_addresses: Iterable[str] -> [190.2.3.4, 200.4.5.5,...]
+                fobj: TextIO,BinaryIO -> sys.stdout
+        Returns:
+                int (lookups written)
+        """
+        return write_ndjson(map(self.lookup, ip_addresses), fobj)
+
+    async def _alookup(
+        self,
+        ip_addr: str,
+        session: requests.Session,
+        executor: ThreadPoolExecutor,
+        limits: dict,
+        concurrency: int,
+        rate: Optional[float],
+    ) -> Tuple[str, Optional[Type["RDAPResponse"]]]:
+        """Async version of RDAP.lookup, limited by its service's semaphore and token bucket.
+        The (blocking) request runs in `executor`, failed requests are just None.
+        Cached IPs (see RDAPCache) don't count against the limits.
+
+        Arguments:
+                ip_addr: str -> 190.2.3.4
+                session: requests.Session -> requests.Session()
+                executor: ThreadPoolExecutor -> ThreadPoolExecutor(...)
+                limits: dict -> {domain: (asyncio.Semaphore, TokenBucket or None), ...}
+                concurrency: int -> 8 (requests in flight per service)
+                rate: float, Optional -> 5.0 (requests per second, per service)
+        Returns:
+                ("190.2.3.4", RDAPResponse(...))
+        """
+        if not self._is_ipv4(ip_addr):
+            return ip_addr, None
+        data = self._cached(ip_addr)
+        if data is not RDAPCache.MISSING:
+            return ip_addr, self._result_type(data=data) if data is not None else None
+        service = self.find_service(ip_addr)
+        if not service:
+            return ip_addr, self._response(ip_addr, None)
+        if service.domain not in limits:
+            limits[service.domain] = (
+                asyncio.Semaphore(concurrency),
+                TokenBucket(rate) if rate else None,
+            )
+        semaphore, bucket = limits[service.domain]
+        async with semaphore:
+            # a lookup of the same network could have finished while waiting.
+            data = self._cached(ip_addr)
+            if data is not RDAPCache.MISSING:
+                return ip_addr, self._result_type(data=data) if data is not None else None
+            if bucket is not None:
+                await bucket.acquire()
+            try:
+                response = await asyncio.get_running_loop().run_in_executor(
+                    executor, session.get, service.get_query_url(ip_addr)
+                )
+            except requests.RequestException:
+                return ip_addr, None
+        return ip_addr, self._response(
+            ip_addr, service.response_data(response, retry_later=RDAPCache.MISSING)
+        )
+
+    async def abatch_lookup(
+        self,
+        ip_addresses: Iterable[str],
+        concurrency: int = 8,
+        rate: Optional[float] = 5.0,
+        rate_limits: Optional[dict] = None,
+    ) -> AsyncGenerator:
+        """Concurrent version of RDAP.batch_lookup. Yields lookups as they complete.
+        Each RDAPService gets its own limits (ARIN, RIPE, APNIC, ... throttle differently):
+        up to `concurrency` requests in flight and a token bucket of `rate` requests per second
+        (`rate_limits` overrides the rate of some services, None disables it).
+        Requests share a pool of (keep-alive) connections (see utils.make_session), at most
+        `concurrency` * (number of services) IPs are being looked up at once.
+
+        Arguments:
+                ip_addresses: Iterable[str] -> [190.2.3.4, 200.4.5.5,...]
+                concurrency: int -> 8
+                rate: float, Optional -> 5.0
+                rate_limits: dict, Optional -> {"https://rdap.arin.net/registry/": 2.0}
+        Returns:
+                Yields ("190.2.3.4", RDAPResponse(...) or None), ...
+        """
+        assert concurrency > 0, ValueError("concurrency must be a positive int")
+        rate_limits = rate_limits or {}
+        max_pending = concurrency * max(1, len(self.get_services()))
+        limits = {
+            domain: (asyncio.Semaphore(concurrency), TokenBucket(rate_) if rate_ else None)
+            for domain, rate_ in rate_limits.items()
+        }
+        session = make_session(pool_connections=max_pending, pool_maxsize=concurrency)
+        executor = ThreadPoolExecutor(max_pending)
+        pending = set()
+        ip_addresses = iter(ip_addresses)
+        try:
+            while True:
+                for ip_addr in ip_addresses:
+                    pending.add(
+                        asyncio.ensure_future(
+                            self._alookup(
+                                ip_addr, session, executor, limits, concurrency, rate
+                            )
+                        )
+                    )
+                    if len(pending) >= max_pending:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            executor.shutdown(wait=False)
+            session.close()
@@ -1,18 +1,46 @@
 #!/usr/bin/env python3
 
+import io
+import os
 import re
+import bz2
+import base64
+import bisect
+import random
+import gzip
+import json
+import lzma
+import time
+import queue
+import asyncio
+import socket
+import struct
 import requests
 import ipaddress
+import threading
 import functools
+import itertools
+import collections
 
+from array import array
+from pathlib import Path
+from typing import Any
 from typing import List
 from typing import Type
+from typing import Tuple
 from typing import Union
 from typing import Literal
 from typing import Optional
 from typing import NoReturn
+from typing import BinaryIO
+from typing import TextIO
+from typing import Hashable
+from typing import Iterable
+from typing import Set
+from typing import Generator
 
 from dataclasses import field
+from dataclasses import fields
 from dataclasses import asdict
 from dataclasses import InitVar
 from dataclasses import dataclass
@@ -21,8 +49,61 @@ from world_class import World
 from world_class import Country
 
 from requests import Response
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-UNKNOWN_COUNTRY = World().find_by_code(value="xx")
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, the stdlib json module is used instead.
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard is optional, only needed to read .zst files.
+    zstandard = None
+
+JSON_BACKEND = "orjson" if orjson else "json"
+
+# (magic bytes, compression), see detect_compression.
+COMPRESSION_MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+
+
+def _build_country_table() -> dict:
+    """Returns a {country_code: Country} dict built from a single World().
+    Codes are lowercased, as World().find_by_code is case-insensitive.
+
+    Arguments:
+        ...
+    Returns:
+        {"ar": Country(...), ...}
+    """
+    countries = {}
+    for country in World():
+        countries.setdefault(country.code.lower(), country)
+    return countries
+
+
+COUNTRIES = _build_country_table()
+UNKNOWN_COUNTRY = COUNTRIES.get("xx")
+
+
+def get_country(country_code: str) -> Type["Country"]:
+    """Returns a Country from a country code, without building (and searching) a World().
+    Same as World().find_by_code, but the Countries are shared, so don't modify them.
+
+    Arguments:
+        country_code: str -> "AR"
+    Returns:
+        Country(...)
+    """
+    return COUNTRIES.get(str(country_code).lower(), UNKNOWN_COUNTRY)
 
 
 class IPv4(ipaddress.IPv4Address):
@@ -37,29 +118,39 @@ class IPv4(ipaddress.IPv4Address):
         [IPv4]: Returns an IPv4 object.
     """
 
+    FIELDS = (
+        "compressed",
+        "exploded",
+        "is_global",
+        "is_link_local",
+        "is_loopback",
+        "is_multicast",
+        "is_private",
+        "is_reserved",
+        "is_unspecified",
+        "max_prefixlen",
+        "reverse_pointer",
+        "version",
+        # "packed",
+        # this one is left behind to make things simpler,
+        # as not always ip.packed.decode("utf8") works as expected
+        # and it's not really necessary for this particular scenario.
+    )
+
     @property
     def __dict__(self) -> dict:
-        return {
-            attr: getattr(self, attr)
-            for attr in [
-                "compressed",
-                "exploded",
-                "is_global",
-                "is_link_local",
-                "is_loopback",
-                "is_multicast",
-                "is_private",
-                "is_reserved",
-                "is_unspecified",
-                "max_prefixlen",
-                "reverse_pointer",
-                "version",
-                # "packed",
-                # this one is left behind to make things simpler,
-                # as not always ip.packed.decode("utf8") works as expected
-                # and it's not really necessary for this particular scenario.
-            ]
-        }
+        return self.asdict()
+
+    def asdict(self, fields: Optional[Iterable[str]] = None) -> dict:
+        """Returns a dict with the IPv4 attributes. Only the `fields` asked for are
+        computed (some of them, like `reverse_pointer`, aren't cheap).
+
+        Arguments:
+                fields: Iterable[str], Optional -> ["compressed", "is_global"] (defaults to IPv4.FIELDS)
+        Returns:
+                {"compressed": "1.2.3.4", "is_global": True}
+        """
+        return {attr: getattr(self, attr) for attr in (fields or self.FIELDS)}
 
 
 @dataclass
@@ -112,6 +203,9 @@ class IPobject(Base):
         ip: str -> "N.N.N.N"
         object: IPv4 -> IPv4("N.N.N.N")
         is_valid: bool -> True
+        count: int, Optional -> 3 (times the IP was seen, defaults to 1)
+        first_line: int, Optional -> 1 (line where the IP was first seen)
+        last_line: int, Optional -> 42 (line where the IP was last seen)
 
     Returns:
         [IPobject]: Returns an IP dataclass, which provides an IP.asdict() method
@@ -121,12 +215,35 @@ class IPobject(Base):
     ip: str
     object: ipaddress.IPv4Address
     is_valid: bool
+    count: int = 1
+    first_line: Optional[int] = None
+    last_line: Optional[int] = None
 
     @property
     def _version(self) -> int:
         """Returns an IPv4Address.version attribute."""
         return self.object.version
 
+    def asdict(self, fields: Optional[Iterable[str]] = None) -> dict:
+        """See Base._asdict(). If `fields`, only those IPv4 attributes are
+        computed (see IPv4.asdict).
+
+        Arguments:
+                fields: Iterable[str], Optional -> ["compressed", "is_global"]
+        Returns:
+                {"ip": "N.N.N.N", "object": {...}, "is_valid": True, "count": 1, ...}
+        """
+        if fields is None:
+            return self._asdict()
+        return {
+            "ip": self.ip,
+            "object": {attr: getattr(self.object, attr) for attr in fields},
+            "is_valid": self.is_valid,
+            "count": self.count,
+            "first_line": self.first_line,
+            "last_line": self.last_line,
+        }
+
     @property
     def version(self) -> int:
         """See IPObject._version."""
@@ -141,7 +258,7 @@ class IPCountry(Base):
 
     Arguments:
         ip: str -> "N.N.N.N"
-        country: Country -> Country(...)
+        country: Country,str -> Country(...) or "AR"
 
     Returns:
         [IPCountry]: Returns an IPCountry dataclass.
@@ -150,6 +267,128 @@ class IPCountry(Base):
     ip: str
     country: Country
 
+    def __post_init__(self) -> Literal[None]:
+        if isinstance(self.country, str):
+            self.country = get_country(self.country)
+
+
+@dataclass
+class GeoIPLoadReport(Base):
+    """GeoIPLoadReport.
+
+    Stats of a Geo Legacy file load.
+
+    Arguments:
+        rows: int -> 120000 (non empty lines read)
+        rejects: int -> 2 (malformed lines skipped)
+        overlaps: int -> 0 (ranges starting before the previous one ended)
+        merged: int -> 1500 (ranges merged into a contiguous one, see GeoIP.compact)
+        elapsed: float -> 0.25 (seconds)
+        errors: List[str] -> ["line 12: Malformed Geo Legacy file, ...", ...]
+        conflicts: List[str] -> ["1.2.3.0-1.2.3.255 (AR) overlaps a range of UY ending at ...", ...]
+
+    Returns:
+        [GeoIPLoadReport]: Returns a GeoIPLoadReport dataclass.
+    """
+
+    MAX_ERRORS = 100
+
+    rows: int = 0
+    rejects: int = 0
+    overlaps: int = 0
+    merged: int = 0
+    elapsed: float = 0.0
+    errors: List[str] = field(default_factory=list)
+    conflicts: List[str] = field(default_factory=list)
+
+    def reject(self, line_no: int, error: Exception) -> Literal[None]:
+        """Counts a malformed line, keeping the first `MAX_ERRORS` reasons.
+
+        Arguments:
+                line_no: int -> 12
+                error: Exception -> AssertionError(...)
+        Returns:
+                ...
+        """
+        self.rejects += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(f"line {line_no}: {error}")
+
+    def conflict(self, message: str) -> Literal[None]:
+        """Records an overlap of ranges of different countries, keeping the first `MAX_ERRORS`.
+
+        Arguments:
+                message: str -> "1.2.3.0-1.2.3.255 (AR) overlaps ..."
+        Returns:
+                ...
+        """
+        if len(self.conflicts) < self.MAX_ERRORS:
+            self.conflicts.append(message)
+
+
+@dataclass
+class IPGrabberCheckpoint(Base):
+    """IPGrabberCheckpoint.
+
+    Where an incremental IPGrabber scan stopped (see IPGrabber.iter_new).
+    Saved as JSON, seen IPs are stored as (base64'd) unsigned 32-bit integers.
+
+    Arguments:
+        path: str -> "/var/log/nginx/access.log"
+        inode: int -> 1234567 (tells a rotated file from the one scanned before)
+        offset: int -> 1048576 (bytes scanned, always the end of a line)
+        line: int -> 5120 (lines scanned)
+        seen: Set[int] -> {16909060, ...} (IPs already emitted)
+
+    Returns:
+        [IPGrabberCheckpoint]: Returns an IPGrabberCheckpoint dataclass.
+    """
+
+    path: str = ""
+    inode: int = 0
+    offset: int = 0
+    line: int = 0
+    seen: Set[int] = field(default_factory=set)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "IPGrabberCheckpoint":
+        """Loads a checkpoint, a missing file is an empty (new) checkpoint.
+
+        Arguments:
+                path: str,Path -> /var/lib/grait/access.log.checkpoint
+        Returns:
+                IPGrabberCheckpoint(...)
+        """
+        path = Path(path)
+        if not path.exists():
+            return cls()
+        checkpoint = json.loads(path.read_text())
+        seen = array("I")
+        seen.frombytes(base64.b64decode(checkpoint.pop("seen")))
+        return cls(**checkpoint, seen=set(seen))
+
+    def save(self, path: Union[str, Path]) -> Literal[None]:
+        """Saves the checkpoint, atomically (a crash never leaves half a checkpoint).
+
+        Arguments:
+                path: str,Path -> /var/lib/grait/access.log.checkpoint
+        Returns:
+                ...
+        """
+        path = Path(path)
+        checkpoint = {
+            "path": self.path,
+            "inode": self.inode,
+            "offset": self.offset,
+            "line": self.line,
+            "seen": base64.b64encode(array("I", sorted(self.seen)).tobytes()).decode(
+                "ascii"
+            ),
+        }
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(json_dumps(checkpoint))
+        os.replace(tmp_path, path)
+
 
 @dataclass
 class RDAPResponse(Base):
@@ -240,8 +479,8 @@ class RDAPResponse(Base):
         Returns:
                 Country(...)
         """
-        country = World().find_by_code(value=country_code)
-        if country == UNKNOWN_COUNTRY and _retry:
+        country = get_country(country_code)
+        if country is UNKNOWN_COUNTRY and _retry:
             country_code = self._parse_country_code_from_entities(self.entities)
             if country_code:
                 return self._parse_country(country_code, False)
@@ -341,6 +580,36 @@ class RDAPService(Base):
         domain = self.domain.strip("/")
         return f"{domain}/ip/{ip_addr}"
 
+    @staticmethod
+    def response_data(response: Response, retry_later: Any = None) -> Any:
+        """Returns the (raw) RDAP JSON response of a request, or None if it failed
+        (ie: 404, the registry has no info). If it's worth retrying later (408, 429 or
+        5xx: timed out, throttled, down), it's `retry_later` instead.
+
+        Arguments:
+                response: requests.Response -> Response(...)
+                retry_later: Any -> RDAPCache.MISSING
+        Returns:
+                {"handle": "...", "startAddress": "1.2.3.0", ...}, None or retry_later
+        """
+        if response.ok:
+            return response.json()
+        if response.status_code in (408, 429) or response.status_code >= 500:
+            return retry_later
+        return None
+
+    def query_ip_data(self, ip_addr: str, retry_later: Any = None) -> Any:
+        """Returns the (raw) RDAP JSON response, or None if the request failed
+        (see RDAPService.response_data).
+
+        Arguments:
+                ip_addr: str -> 1.2.3.4
+                retry_later: Any -> RDAPCache.MISSING
+        Returns:
+                {"handle": "...", "startAddress": "1.2.3.0", ...}, None or retry_later
+        """
+        return self.response_data(http_get(self.get_query_url(ip_addr)), retry_later)
+
     def query_ip(self, ip_addr: str) -> Optional[Type["RDAPResponse"]]:
         """Returns a RDAPResponse
 
@@ -349,9 +618,192 @@ class RDAPService(Base):
         Returns:
                 RDAPResponse(...)
         """
-        response = http_get(self.get_query_url(ip_addr))
-        if response.ok:
-            return RDAPResponse(data=response.json())
+        data = self.query_ip_data(ip_addr)
+        if data is not None:
+            return RDAPResponse(data=data)
+
+
+class CompactIPobject:
+    """CompactIPobject.
+
+    A lightweight (__slots__, no __dict__) version of IPobject. Keeps the IP as
+    an unsigned 32-bit integer, the IPv4 object is built only when asked for.
+    CompactIPobject.asdict() returns the same dict as IPobject.asdict().
+
+    Arguments:
+        ip: str,int -> "N.N.N.N" or 16909060
+        is_valid: bool, Optional -> True (defaults to IPv4.is_global)
+        count: int, Optional -> 3 (see IPobject)
+        first_line: int, Optional -> 1 (see IPobject)
+        last_line: int, Optional -> 42 (see IPobject)
+
+    Returns:
+        [CompactIPobject]: Returns a CompactIPobject.
+    """
+
+    __slots__ = ("_ip", "is_valid", "count", "first_line", "last_line")
+
+    def __init__(
+        self,
+        ip: Union[str, int],
+        is_valid: Optional[bool] = None,
+        count: int = 1,
+        first_line: Optional[int] = None,
+        last_line: Optional[int] = None,
+    ) -> Literal[None]:
+        self._ip = ip if isinstance(ip, int) else ipv4_to_int(ip)
+        self.is_valid = self.object.is_global if is_valid is None else is_valid
+        self.count = count
+        self.first_line = first_line
+        self.last_line = last_line
+
+    @property
+    def ip(self) -> str:
+        """Returns the IP as a string."""
+        return int_to_ipv4(self._ip)
+
+    @property
+    def object(self) -> IPv4:
+        """Returns the IP as an IPv4 object."""
+        return IPv4(self._ip)
+
+    @property
+    def version(self) -> int:
+        """See IPObject.version."""
+        return 4
+
+    def asdict(self, fields: Optional[Iterable[str]] = None) -> dict:
+        """Returns a dict like IPobject.asdict(), but only computes the
+        IPv4 `fields` asked for (see IPv4.asdict).
+
+        Arguments:
+                fields: Iterable[str], Optional -> ["compressed", "is_global"]
+        Returns:
+                {"ip": "N.N.N.N", "object": {...}, "is_valid": True, "count": 1, ...}
+        """
+        return {
+            "ip": self.ip,
+            "object": self.object.asdict(fields),
+            "is_valid": self.is_valid,
+            "count": self.count,
+            "first_line": self.first_line,
+            "last_line": self.last_line,
+        }
+
+    def _astuple(self) -> tuple:
+        return (self.ip, self.is_valid, self.count, self.first_line, self.last_line)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, CompactIPobject):
+            return self._astuple() == other._astuple()
+        if isinstance(other, IPobject):
+            return self._astuple() == (
+                other.ip,
+                other.is_valid,
+                other.count,
+                other.first_line,
+                other.last_line,
+            )
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self._ip, self.is_valid))
+
+    def __repr__(self) -> str:
+        return (
+            f"CompactIPobject(ip={self.ip!r}, is_valid={self.is_valid!r}, "
+            f"count={self.count!r}, first_line={self.first_line!r}, "
+            f"last_line={self.last_line!r})"
+        )
+
+
+class CompactIPCountry:
+    """CompactIPCountry.
+
+    A lightweight (__slots__, no __dict__) version of IPCountry.
+    CompactIPCountry.asdict() returns the same dict as IPCountry.asdict().
+
+    Arguments:
+        ip: str -> "N.N.N.N"
+        country: Country,str -> Country(...) or "AR"
+
+    Returns:
+        [CompactIPCountry]: Returns a CompactIPCountry.
+    """
+
+    __slots__ = ("ip", "country")
+
+    def __init__(self, ip: str, country: Union[Country, str]) -> Literal[None]:
+        self.ip = ip
+        self.country = get_country(country) if isinstance(country, str) else country
+
+    def asdict(self) -> dict:
+        """Returns a dict with the IP and the Country.
+
+        Arguments:
+                ...
+        Returns:
+                {"ip": "N.N.N.N", "country": {...}}
+        """
+        return {"ip": self.ip, "country": asdict(self.country)}
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (CompactIPCountry, IPCountry)):
+            return (self.ip, self.country) == (other.ip, other.country)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"CompactIPCountry(ip={self.ip!r}, country={self.country!r})"
+
+
+class CompactRDAPResponse:
+    """CompactRDAPResponse.
+
+    A lightweight (__slots__, no __dict__) version of RDAPResponse, parsed the same way.
+    CompactRDAPResponse.asdict() returns the same dict as RDAPResponse.asdict(),
+    without deep-copying it, so don't modify it.
+
+    Arguments:
+        data: dict -> {"handle": "...", "entities":..., ...}
+
+    Returns:
+        [CompactRDAPResponse]: Returns a CompactRDAPResponse.
+    """
+
+    __slots__ = tuple(field_.name for field_ in fields(RDAPResponse))
+
+    __init__ = RDAPResponse.__post_init__
+    _parse_version = RDAPResponse._parse_version
+    _parse_country_code_from_entities = RDAPResponse._parse_country_code_from_entities
+    _parse_country = RDAPResponse._parse_country
+    _parse_vcard = RDAPResponse._parse_vcard
+    _parse_entities = RDAPResponse._parse_entities
+
+    def asdict(self) -> dict:
+        """Returns a dict with the RDAP response fields.
+
+        Arguments:
+                ...
+        Returns:
+                {"handle": "...", "country": {...}, ...}
+        """
+        self_dict = {attr: getattr(self, attr) for attr in self.__slots__}
+        self_dict["country"] = asdict(self.country)
+        return self_dict
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, (CompactRDAPResponse, RDAPResponse)):
+            return all(
+                getattr(self, attr) == getattr(other, attr) for attr in self.__slots__
+            )
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"CompactRDAPResponse(handle={self.handle!r}, name={self.name!r})"
 
 
 def str_to_ipv4(ip_addr: str) -> Union[ipaddress.IPv4Address, IPv4, NoReturn]:
@@ -363,13 +815,92 @@ def str_to_ipv4(ip_addr: str) -> Union[ipaddress.IPv4Address, IPv4, NoReturn]:
         IPv4(...)
     """
     try:
-        ipv4 = IPv4(ip_addr)
+        # building it from an int skips ipaddress' (slower) string parsing.
+        ipv4 = IPv4(ipv4_to_int(ip_addr))
     except Exception as e:
         raise e
     else:
         return ipv4
 
 
+_UINT32 = struct.Struct("!I")
+
+
+def ipv4_to_int(ip_addr: Union[str, ipaddress.IPv4Address]) -> int:
+    """Returns an IPv4 as an unsigned 32-bit integer.
+    Strings are validated (and parsed) by inet_pton, which is as strict as
+    ipaddress.IPv4Address (no leading zeros, no short forms) but way faster.
+
+    Arguments:
+        ip_addr: str,IPv4,ipaddress.IPv4Address -> 1.2.3.4
+    Returns:
+        16909060
+    """
+    if isinstance(ip_addr, ipaddress.IPv4Address):
+        return int(ip_addr)
+    try:
+        return _UINT32.unpack(socket.inet_pton(socket.AF_INET, ip_addr))[0]
+    except (OSError, TypeError):
+        raise ipaddress.AddressValueError(
+            f"{ip_addr!r} does not appear to be an IPv4 address"
+        ) from None
+
+
+def ipv4s_to_ints(ip_addresses: Iterable[Union[str, ipaddress.IPv4Address]]) -> array:
+    """Batch version of ipv4_to_int.
+
+    Arguments:
+        ip_addresses: Iterable[str,IPv4,ipaddress.IPv4Address] -> ["1.2.3.4", "190.10.22.63", ...]
+    Returns:
+        array("I", [16909060, 3188331071, ...])
+    """
+    return array("I", map(ipv4_to_int, ip_addresses))
+
+
+def ip_to_int(
+    ip_addr: Union[str, ipaddress.IPv4Address, ipaddress.IPv6Address]
+) -> Tuple[int, int]:
+    """Returns the version and the integer value of an IPv4 or IPv6.
+
+    Arguments:
+        ip_addr: str,IPv4,ipaddress.IPv4Address,ipaddress.IPv6Address -> 2001:db8::1
+    Returns:
+        (6, 42540766411282592856903984951653826561)
+    """
+    if isinstance(ip_addr, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return ip_addr.version, int(ip_addr)
+    if ":" in ip_addr:
+        try:
+            return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip_addr), "big")
+        except OSError:
+            raise ipaddress.AddressValueError(
+                f"{ip_addr!r} does not appear to be an IPv6 address"
+            ) from None
+    return 4, ipv4_to_int(ip_addr)
+
+
+def int_to_ipv6(ip_int: int) -> str:
+    """Returns an unsigned 128-bit integer as a (compressed) IPv6.
+
+    Arguments:
+        ip_int: int -> 42540766411282592856903984951653826561
+    Returns:
+        "2001:db8::1"
+    """
+    return str(ipaddress.IPv6Address(ip_int))
+
+
+def int_to_ipv4(ip_int: int) -> str:
+    """Returns an unsigned 32-bit integer as a dotted IPv4.
+
+    Arguments:
+        ip_int: int -> 16909060
+    Returns:
+        "1.2.3.4"
+    """
+    return socket.inet_ntoa(_UINT32.pack(ip_int))
+
+
 def get_octet(ip_addr: str, idx: int = 0) -> str:
     """Returns an octet (0 to 255)"
 
@@ -379,16 +910,586 @@ def get_octet(ip_addr: str, idx: int = 0) -> str:
     Returns:
         123
     """
+    if idx == 0:
+        return ip_addr.partition(".")[0]
     return str(ip_addr.split(".")[idx])
 
 
-@functools.lru_cache()
-def http_get(url: str) -> Type["Response"]:
-    """Returns a HTTP Response
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "maxsize", "currsize"]
+)
+
+
+class LRUCache:
+    """LRUCache.
+
+    A bounded, thread-safe, Least Recently Used cache that keeps track of hits,
+    misses and evictions. Unlike functools.lru_cache, it can be cleared (or replaced)
+    along with whatever it caches.
+
+    Arguments:
+        maxsize: int -> 4096
+
+    Returns:
+        [LRUCache]: An LRUCache object.
+    """
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int) -> Literal[None]:
+        self.maxsize = maxsize
+        self.hits = self.misses = self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = MISSING) -> Any:
+        """Returns a cached value (or `default`), marking it as recently used.
+
+        Arguments:
+                key: Hashable -> 16909060
+                default: Any -> LRUCache.MISSING
+        Returns:
+                Any
+        """
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> Literal[None]:
+        """Caches a value, evicting the least recently used one if full.
+
+        Arguments:
+                key: Hashable -> 16909060
+                value: Any -> IPCountry(...)
+        Returns:
+                ...
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> Literal[None]:
+        """Empties the cache (counters are kept)."""
+        with self._lock:
+            self._data.clear()
+
+    def cache_info(self) -> CacheInfo:
+        """Returns a CacheInfo(hits, misses, evictions, maxsize, currsize)."""
+        return CacheInfo(
+            self.hits, self.misses, self.evictions, self.maxsize, len(self._data)
+        )
+
+
+class PrefixTable:
+    """PrefixTable.
+
+    Longest prefix match of IPv4 addresses against IPv4 networks (of any length).
+    Keeps a dict per prefix length, {network >> (32 - prefix length): value},
+    so a match takes (at most) one dict lookup per distinct prefix length.
+
+    Arguments:
+        ...
+
+    Returns:
+        [PrefixTable]: A PrefixTable object, see PrefixTable.add and PrefixTable.get
+    """
+
+    MISSING = object()
+
+    def __init__(self) -> Literal[None]:
+        self._tables = {}
+        self._prefixlens = []
+
+    def add(self, network: Union[str, ipaddress.IPv4Network], value: Any) -> Literal[None]:
+        """Adds (or replaces) a network.
+
+        Arguments:
+                network: str,ipaddress.IPv4Network -> "41.0.0.0/8"
+                value: Any -> RDAPService(...)
+        Returns:
+                ...
+        """
+        network = ipaddress.IPv4Network(network)
+        prefixlen = network.prefixlen
+        table = self._tables.setdefault(prefixlen, {})
+        table[int(network.network_address) >> (32 - prefixlen)] = value
+        self._prefixlens = sorted(self._tables, reverse=True)
+
+    def get(self, ip_addr: Union[str, int, ipaddress.IPv4Address], default: Any = None) -> Any:
+        """Returns the value of the longest (most specific) network holding `ip_addr`.
+
+        Arguments:
+                ip_addr: str,int,IPv4,ipaddress.IPv4Address -> 41.2.3.4
+                default: Any -> None
+        Returns:
+                Any -> RDAPService(...) or `default`
+        """
+        ip_int = ip_addr if isinstance(ip_addr, int) else ipv4_to_int(ip_addr)
+        for prefixlen in self._prefixlens:
+            value = self._tables[prefixlen].get(ip_int >> (32 - prefixlen), self.MISSING)
+            if value is not self.MISSING:
+                return value
+        return default
+
+    def __len__(self) -> int:
+        return sum(len(table) for table in self._tables.values())
+
+
+class IPv4Set:
+    """IPv4Set.
+
+    A compact set of IPv4s (unsigned 32-bit ints). IPs are grouped by /16: a group keeps
+    the low 16 bits of its IPs in a sorted array("H"), 2 bytes per IP, and turns into a
+    bitmap of the whole /16 (8 KiB) once that's smaller. A million scattered IPs cost
+    ~11 bytes each (2 per IP plus the arrays of the /16s they fall in), dense ones ~2;
+    a set of ints costs ~65 bytes per IP. The price is speed: an add is a bisect (and an
+    insert) in pure Python, ~2us against ~0.2us for a set.
+
+    Arguments:
+        ips: Iterable[int], Optional -> [16909060, ...]
+
+    Returns:
+        [IPv4Set]: An IPv4Set object, see IPv4Set.add and `in`.
+    """
+
+    ARRAY_MAX = 4096
+
+    def __init__(self, ips: Iterable[int] = ()) -> Literal[None]:
+        self._groups = {}
+        self._len = 0
+        for ip_int in ips:
+            self.add(ip_int)
+
+    def add(self, ip_int: int) -> bool:
+        """Adds an IP.
+
+        Arguments:
+                ip_int: int -> 16909060
+        Returns:
+                bool (True if it wasn't in the set)
+        """
+        high, low = ip_int >> 16, ip_int & 0xFFFF
+        group = self._groups.get(high)
+        if group is None:
+            self._groups[high] = array("H", [low])
+        elif isinstance(group, bytearray):
+            if group[low >> 3] & 1 << (low & 7):
+                return False
+            group[low >> 3] |= 1 << (low & 7)
+        else:
+            idx = bisect.bisect_left(group, low)
+            if idx < len(group) and group[idx] == low:
+                return False
+            group.insert(idx, low)
+            if len(group) > self.ARRAY_MAX:
+                bitmap = bytearray(1 << 13)
+                for low_ in group:
+                    bitmap[low_ >> 3] |= 1 << (low_ & 7)
+                self._groups[high] = bitmap
+        self._len += 1
+        return True
+
+    def __contains__(self, ip_int: int) -> bool:
+        high, low = ip_int >> 16, ip_int & 0xFFFF
+        group = self._groups.get(high)
+        if group is None:
+            return False
+        if isinstance(group, bytearray):
+            return bool(group[low >> 3] & 1 << (low & 7))
+        idx = bisect.bisect_left(group, low)
+        return idx < len(group) and group[idx] == low
+
+    def __iter__(self) -> Generator:
+        for high in sorted(self._groups):
+            group = lows = self._groups[high]
+            if isinstance(group, bytearray):
+                lows = (low for low in range(1 << 16) if group[low >> 3] & 1 << (low & 7))
+            for low in lows:
+                yield high << 16 | low
+
+    def __len__(self) -> int:
+        return self._len
+
+
+class TokenBucket:
+    """TokenBucket.
+
+    An (asyncio) token bucket rate limiter: `rate` tokens per second are added,
+    up to `capacity` (the allowed burst). TokenBucket.acquire waits for a token.
+
+    Arguments:
+        rate: float -> 5.0 (tokens per second)
+        capacity: float -> 1.0
+
+    Returns:
+        [TokenBucket]: A TokenBucket object.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> Literal[None]:
+        assert rate > 0, ValueError("rate must be positive")
+        assert capacity >= 1, ValueError("capacity must be at least 1")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = None
+
+    async def acquire(self) -> Literal[None]:
+        """Takes a token, waiting (without blocking the event loop) until there's one."""
+        if self._lock is None:
+            # created here, so it belongs to the running loop.
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def set_json_backend(backend: str) -> Literal[None]:
+    """Selects the JSON encoder used by the `*_serialized` and `*_ndjson` methods.
+
+    Arguments:
+        backend: str -> "orjson" or "json"
+    Returns:
+        ...
+    """
+    global JSON_BACKEND
+    assert backend in ["json", "orjson"], ValueError(f"Unknown JSON backend: {backend}")
+    assert backend != "orjson" or orjson, ImportError("orjson is not installed!")
+    JSON_BACKEND = backend
+
+
+def json_dumpb(obj: Any) -> bytes:
+    """Returns `obj` encoded as (UTF-8) JSON bytes, with orjson if available.
+
+    Arguments:
+        obj: Any -> {"ip": "1.2.3.4"}
+    Returns:
+        b'{"ip":"1.2.3.4"}'
+    """
+    if JSON_BACKEND == "orjson":
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf8")
+
+
+def json_dumps(obj: Any) -> str:
+    """Returns `obj` encoded as JSON, with orjson if available.
+
+    Arguments:
+        obj: Any -> {"ip": "1.2.3.4"}
+    Returns:
+        '{"ip":"1.2.3.4"}'
+    """
+    if JSON_BACKEND == "orjson":
+        return orjson.dumps(obj).decode("utf8")
+    return json.dumps(obj)
+
+
+def write_ndjson(records: Iterable, fobj: Union[io.TextIOBase, BinaryIO]) -> int:
+    """Writes one JSON document per line (NDJSON), one record at a time, so only
+    the record being written is kept in memory. `None` records are skipped.
+
+    Arguments:
+        records: Iterable[Base,dict] -> [IPCountry(...), {...}, None, ...]
+        fobj: TextIO,BinaryIO -> sys.stdout or open("results.ndjson", "wb")
+    Returns:
+        2 (records written)
+    """
+    text = isinstance(fobj, io.TextIOBase)
+    written = 0
+    for record in records:
+        if record is None:
+            continue
+        if hasattr(record, "asdict"):
+            record = record.asdict()
+        line = json_dumpb(record) + b"\n"
+        fobj.write(line.decode("utf8") if text else line)
+        written += 1
+
+    return written
+
+
+def detect_compression(path: Union[str, Path]) -> Optional[str]:
+    """Tells a compressed file by its magic bytes (the extension doesn't matter).
+
+    Arguments:
+        path: str,Path -> /var/log/access.log.1.gz
+    Returns:
+        "gzip", "bz2", "xz", "zstd" or None (not compressed)
+    """
+    with open(path, "rb") as fobj:
+        head = fobj.read(6)
+    for magic, compression in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+class ThreadedReader(io.RawIOBase):
+    """ThreadedReader.
+
+    Reads a file object in a background thread, a few blocks ahead of the consumer.
+    Wrapped around a decompressing file object, decompression (zlib, bz2, lzma
+    and zstd release the GIL) overlaps with whatever the consumer does with the data.
+
+    Arguments:
+        fobj: BinaryIO -> gzip.open("access.log.gz", "rb")
+        block_size: int -> 1048576
+        depth: int -> 4 (blocks read ahead)
+
+    Returns:
+        [ThreadedReader]: A (raw, readable) file object, closing it closes `fobj`.
+    """
+
+    def __init__(
+        self, fobj: BinaryIO, block_size: int = 1 << 20, depth: int = 4
+    ) -> Literal[None]:
+        super().__init__()
+        self._fobj = fobj
+        self._block_size = block_size
+        self._queue = queue.Queue(depth)
+        self._stop = threading.Event()
+        self._block = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._fill, daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Union[bytes, BaseException]) -> bool:
+        """Queues `item`, unless the reader gets closed while waiting."""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fill(self) -> Literal[None]:
+        """Reads `fobj` until EOF (an empty block), errors are passed to the consumer."""
+        try:
+            while True:
+                block = self._fobj.read(self._block_size)
+                if not self._put(block) or not block:
+                    return
+        except BaseException as e:
+            self._put(e)
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        if not self._block and not self._eof:
+            block = self._queue.get()
+            if isinstance(block, BaseException):
+                self._eof = True
+                raise block
+            self._eof = not block
+            self._block = memoryview(block)
+        size = min(len(buffer), len(self._block))
+        buffer[:size] = self._block[:size]
+        self._block = self._block[size:]
+        return size
+
+    def close(self) -> Literal[None]:
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._fobj.close()
+        super().close()
+
+
+def open_input(
+    path: Union[str, Path],
+    mode: str = "rb",
+    threaded: bool = True,
+    newline: Optional[str] = None,
+) -> Union[TextIO, BinaryIO]:
+    """Opens a (maybe) compressed file for reading, see detect_compression.
+    Compressed files are decompressed on the fly (no temporary files), in a
+    background thread if `threaded` (see ThreadedReader).
+    Plain files are just `open`ed.
+
+    Arguments:
+        path: str,Path -> /var/log/access.log.1.gz
+        mode: str -> "rb" or "r" (text)
+        threaded: bool -> True
+        newline: str, Optional -> "\\n" (text mode only, see open, defaults to universal newlines)
+    Returns:
+        A file object.
+    """
+    assert mode in ("r", "rb"), ValueError("open_input only reads, mode: 'r' or 'rb'")
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, mode, newline=newline) if mode == "r" else open(path, mode)
+    if compression == "gzip":
+        fobj = gzip.open(path, "rb")
+    elif compression == "bz2":
+        fobj = bz2.open(path, "rb")
+    elif compression == "xz":
+        fobj = lzma.open(path, "rb")
+    else:
+        assert zstandard is not None, ImportError(
+            "Reading .zst files requires zstandard!"
+        )
+        fobj = zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+    if threaded:
+        fobj = io.BufferedReader(ThreadedReader(fobj))
+    if mode == "r":
+        return io.TextIOWrapper(fobj, newline=newline)
+    return fobj
+
+
+def chunked(iterable: Iterable, size: int) -> Generator:
+    """Yields lists of (up to) `size` items of an iterable.
+
+    Arguments:
+        iterable: Iterable -> [1, 2, 3, 4, 5]
+        size: int -> 2
+    Returns:
+        Yields [1, 2], [3, 4], [5]
+    """
+    iterator = iter(iterable)
+    chunk = list(itertools.islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(itertools.islice(iterator, size))
+
+
+class JitterRetry(Retry):
+    """JitterRetry.
+
+    A urllib3 Retry with "full jitter": each backoff is a random time between 0 and
+    the (exponential) backoff Retry would wait, so clients throttled at the same
+    time don't retry at the same time. Retry-After headers are still respected.
+    """
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+
+class HTTPSession(requests.Session):
+    """HTTPSession.
+
+    A requests.Session with a default timeout (requests has none, a stalled
+    server would block forever). A `timeout` passed to a request wins.
+
+    Arguments:
+        timeout: float,Tuple[float, float] -> (5, 30) (connect, read)
+
+    Returns:
+        [HTTPSession]: An HTTPSession object.
+    """
+
+    def __init__(self, timeout: Union[float, Tuple[float, float]]) -> Literal[None]:
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method: str, url: str, **kwargs: Any) -> Type["Response"]:
+        kwargs.setdefault("timeout", self.timeout)
+        return super().request(method, url, **kwargs)
+
+
+HTTP_TIMEOUT = (5, 30)
+HTTP_HEADERS = {
+    "User-Agent": "grait",
+    "Accept": "application/rdap+json, application/json;q=0.9, */*;q=0.8",
+    "Accept-Encoding": "gzip, deflate",
+}
+_session = None
+_session_lock = threading.Lock()
+
+
+def make_session(
+    pool_connections: int = 10,
+    pool_maxsize: int = 10,
+    retries: int = 3,
+    backoff_factor: float = 0.5,
+    timeout: Union[float, Tuple[float, float]] = HTTP_TIMEOUT,
+) -> HTTPSession:
+    """Returns an HTTPSession: keep-alive connections, pooled per host, compressed
+    responses, a default timeout and (jittered, exponential backoff) retries of
+    failed connections and 429/5xx responses.
+
+    Arguments:
+        pool_connections: int -> 10 (hosts with a pool)
+        pool_maxsize: int -> 10 (connections kept per host)
+        retries: int -> 3
+        backoff_factor: float -> 0.5 (seconds, see urllib3's Retry)
+        timeout: float,Tuple[float, float] -> (5, 30) (connect, read)
+    Returns:
+        HTTPSession(...)
+    """
+    retry = JitterRetry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        # the last response is returned, instead of raising, once retries run out.
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry
+    )
+    session = HTTPSession(timeout)
+    session.headers.update(HTTP_HEADERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session() -> HTTPSession:
+    """Returns the HTTPSession shared by grait (see make_session), created on first use.
+
+    Arguments:
+        ...
+    Returns:
+        HTTPSession(...)
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def set_session(session: Optional[requests.Session]) -> Literal[None]:
+    """Replaces the HTTPSession shared by grait, ie: make_session(retries=5).
+    None drops it (a default one is created on next use).
+
+    Arguments:
+        session: requests.Session, Optional -> make_session(...)
+    Returns:
+        ...
+    """
+    global _session
+    with _session_lock:
+        _session = session
+
+
+def http_get(url: str, **kwargs: Any) -> Type["Response"]:
+    """Returns a HTTP Response, using the shared session (see get_session)
 
     Arguments:
         url: str -> https://domain.tld/
+        kwargs: Any -> stream=True (see requests.Session.get)
     Returns:
         Response(...)
     """
-    return requests.get(url)
+    return get_session().get(url, **kwargs)
@@ -23,7 +23,7 @@ setup(
     packages=["grait"],
     include_package_data=True,
     install_requires=requirements_txt,
-    extras_require={"dev": ["flake8", "pylint", "ipython"]},
+    extras_require={"dev": ["flake8", "pylint", "ipython"], "numpy": ["numpy"], "zstd": ["zstandard"]},
     entry_points={},
-    scripts=["bin/geoip-query", "bin/ipgrabber", "bin/rdap-lookup", "bin/get-geoipcountrywhois"],
+    scripts=["bin/geoip-query", "bin/geoip-compile", "bin/ipgrabber", "bin/rdap-lookup", "bin/get-geoipcountrywhois", "bin/ip-enrich"],
 )
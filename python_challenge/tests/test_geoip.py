@@ -1,16 +1,27 @@
+import io
+import bz2
+import gzip
 import json
+import lzma
 import random
+import tempfile
 
 from pathlib import Path
 from unittest import TestCase
+from unittest import skipUnless
 
 from world_class import Country
 from world_class import World
 
 from grait import GeoIP
+from grait.geoip import np
 from grait.utils import IPv4
 from grait.utils import IPCountry
+from grait.utils import CompactIPCountry
 from grait.utils import get_octet
+from grait.utils import int_to_ipv4
+from grait.utils import ipv4_to_int
+from grait.utils import ipv4s_to_ints
 
 
 def get_country(cc: str) -> Country:
@@ -19,6 +30,7 @@ def get_country(cc: str) -> Country:
 
 class GeoIPTestCase(TestCase):
     GEOCSV_PATH = Path(__file__).parent / "test_data/geoipwhois_test.csv"
+    GEOCSV6_PATH = Path(__file__).parent / "test_data/geoipv6_test.csv"
 
     def setUp(self):
         self.geo = GeoIP(self.GEOCSV_PATH)
@@ -39,6 +51,42 @@ class GeoIPTestCase(TestCase):
         cc = random.choice(self.cc)
         self.assertEqual(self.countries.get(cc), self.geo.get_country(cc))
 
+    def test_ipcountry_code(self):
+        "test IPCountry built from a country code"
+        cc = random.choice(self.cc)
+        ip = self.country_ips.get("JP")
+        self.assertEqual(IPCountry(ip, cc.lower()), IPCountry(ip, self.countries.get(cc)))
+        self.assertEqual(IPCountry(ip, "??").country, get_country("XX"))
+
+    def test_compact_ipcountry(self):
+        "test CompactIPCountry"
+        located = self.geo.locate(self.country_ips.get("DE"))
+        compact = CompactIPCountry(located.ip, "de")
+        self.assertEqual(located, compact)
+        self.assertEqual(located.asdict(), compact.asdict())
+        self.assertFalse(hasattr(compact, "__dict__"))
+
+    def test_compact_results(self):
+        "test geoip compact_results, located as CompactIPCountrys"
+        ips = list(self.country_ips.values()) + ["1.4.255.255"]
+        for cache_size in (0, 8):
+            geo = GeoIP(self.GEOCSV_PATH, cache_size=cache_size, compact_results=True)
+            located = geo.batch_locate(ips + ips)
+            self.assertEqual(self.geo.batch_locate(ips + ips), located)
+            self.assertTrue(all(isinstance(loc, CompactIPCountry) for loc in located if loc))
+            self.assertEqual(
+                self.geo.batch_locate_serialized(ips), geo.batch_locate_serialized(ips)
+            )
+
+    def test_ipv4_to_int(self):
+        "test utils.ipv4_to_int + utils.int_to_ipv4"
+        for ip in list(self.country_ips.values()) + ["0.0.0.0", "255.255.255.255"]:
+            self.assertEqual(int(IPv4(ip)), ipv4_to_int(ip))
+            self.assertEqual(ip, int_to_ipv4(ipv4_to_int(ip)))
+        self.assertEqual([16909060, 16909060], list(ipv4s_to_ints(["1.2.3.4", IPv4("1.2.3.4")])))
+        for ip in ["01.2.3.4", "1.2.3", "256.1.1.1", " 1.2.3.4", "1.2.3.4.5", "::1"]:
+            self.assertRaises(ValueError, ipv4_to_int, ip)
+
     def test_get_country_range(self):
         "test geoip.get_country"
         cc = random.choice(self.cc)
@@ -60,3 +108,199 @@ class GeoIPTestCase(TestCase):
         country = self.countries.get(cc)
         ipcountry = IPCountry(ip, country)
         self.assertEqual(ipcountry, self.geo.locate(ip))
+
+    def test_locate_index(self):
+        "test geoip.locate against the country ranges"
+        for cc in self.cc:
+            for first, last in self.geo.get_country_range(cc):
+                for ip in [first, last]:
+                    self.assertEqual(self.geo.locate(ip).country, self.countries.get(cc))
+        self.assertIsNone(self.geo.locate("1.4.255.255"))
+        self.assertIsNone(self.geo.locate("200.1.2.3"))
+
+    def test_locate_nested(self):
+        "test geoip.locate with nested (and overlapping) ranges, the narrowest one wins"
+        with tempfile.TemporaryDirectory() as tmp:
+            geofile = Path(tmp) / "geoipwhois_nested.csv"
+            geofile.write_text(
+                '"1.0.0.0","1.0.255.255","16777216","16842751","AU","Australia"\n'
+                '"1.0.1.0","1.0.1.255","16777472","16777727","CN","China"\n'
+                '"1.0.1.128","1.0.2.127","16777600","16777855","JP","Japan"\n'
+            )
+            compiled = Path(tmp) / "geoipwhois_nested.bin"
+            GeoIP.compile(geofile, compiled)
+            for geo in [GeoIP(geofile), GeoIP.from_compiled(compiled)]:
+                located = geo.batch_locate(
+                    ["1.0.0.1", "1.0.1.1", "1.0.1.200", "1.0.2.1", "1.0.5.5", "1.0.255.255"]
+                )
+                self.assertEqual(
+                    ["AU", "CN", "CN", "JP", "AU", "AU"], [loc.country["code"] for loc in located]
+                )
+            self.assertEqual(2, GeoIP(geofile).load_report.overlaps)
+            self.assertEqual(
+                [("1.0.0.0", "1.0.0.255"), ("1.0.2.128", "1.0.255.255")],
+                GeoIP(geofile).get_country_range("AU"),
+            )
+
+    def test_from_compiled(self):
+        "test geoip.compile + geoip.from_compiled"
+        with tempfile.TemporaryDirectory() as tmp:
+            compiled = Path(tmp) / "geoipwhois_test.bin"
+            GeoIP.compile(self.GEOCSV_PATH, compiled)
+            geo = GeoIP.from_compiled(compiled)
+            for ip in list(self.country_ips.values()) + ["1.4.255.255", "200.1.2.3"]:
+                self.assertEqual(self.geo.locate(ip), geo.locate(ip))
+
+    def test_compressed(self):
+        "test geoip with compressed CSVs"
+        with tempfile.TemporaryDirectory() as tmp:
+            for ext, compress in [("gz", gzip), ("bz2", bz2), ("xz", lzma)]:
+                geofile = Path(tmp) / f"geoipwhois_test.{ext}"
+                geofile.write_bytes(compress.compress(self.GEOCSV_PATH.read_bytes()))
+                geo = GeoIP(geofile)
+                for ip in list(self.country_ips.values()) + ["1.4.255.255"]:
+                    self.assertEqual(self.geo.locate(ip), geo.locate(ip))
+
+    @skipUnless(np, "requires numpy")
+    def test_batch_locate_array(self):
+        "test geoip.batch_locate_array"
+        ips = list(self.country_ips.values()) + ["1.4.255.255", "200.1.2.3"]
+        codes = [loc.country.code if loc else "" for loc in self.geo.batch_locate(ips)]
+        country_idx, country_codes = self.geo.batch_locate_array(ips)
+        self.assertEqual(codes, country_codes.tolist())
+        self.assertEqual([-1, -1], country_idx[-2:].tolist())
+        ip_ints = np.array([int(IPv4(ip)) for ip in ips], dtype=np.uint32)
+        self.assertEqual(codes, self.geo.batch_locate_array(ip_ints)[1].tolist())
+
+    @skipUnless(np, "requires numpy")
+    def test_batch_locate_array_out_of_range(self):
+        "test geoip.batch_locate_array with values out of the IPv4 range"
+        jp = int(IPv4(self.country_ips.get("JP")))
+        ip_ints = np.array([jp, 2 ** 32 + jp, -1, -(2 ** 32) + jp, 0], dtype=np.int64)
+        country_idx, country_codes = self.geo.batch_locate_array(ip_ints)
+        self.assertEqual(["JP", "", "", "", ""], country_codes.tolist())
+        self.assertEqual([-1, -1, -1, -1], country_idx[1:].tolist())
+        self.assertEqual(
+            ["JP", ""],
+            self.geo.batch_locate_array(np.array([jp, 2 ** 40], dtype=np.uint64))[1].tolist(),
+        )
+        self.assertRaises(AssertionError, self.geo.batch_locate_array, np.array([1.5]))
+
+    def test_reload(self):
+        "test geoip.reload + geoip.close"
+        with tempfile.TemporaryDirectory() as tmp:
+            geofile = Path(tmp) / "geoipwhois_de.csv"
+            geofile.write_text(self.GEOCSV_PATH.read_text().splitlines()[-1])
+            with GeoIP(geofile) as geo:
+                self.assertIsNone(geo.get_country_range("JP"))
+                geo.reload(self.GEOCSV_PATH)
+                ip = self.country_ips.get("JP")
+                self.assertEqual(geo.locate(ip), self.geo.locate(ip))
+                geo.reload(geofile)
+                self.assertIsNone(geo.locate(ip))
+            self.assertIsNotNone(self.geo.get_country_range("JP"))
+            self.assertRaises(AssertionError, geo.locate, self.country_ips.get("DE"))
+
+    def test_load_report(self):
+        "test geoip.load_report"
+        report = self.geo.load_report
+        self.assertEqual((17, 0, 0), (report.rows, report.rejects, report.overlaps))
+        with tempfile.TemporaryDirectory() as tmp:
+            geofile = Path(tmp) / "geoipwhois_bad.csv"
+            geofile.write_text(
+                self.GEOCSV_PATH.read_text()
+                + '"2.16.7.0","2.16.7.255","34604800","34605055","DE","Germany"\n'
+                + '"2.16.8.0","2.16.8.255","34605056","DE","Germany"\n'
+                + '"2.16.9.0","2.16.8.255","34605312","34605311","DE","Germany"\n'
+            )
+            report = GeoIP(geofile).load_report
+            self.assertEqual((20, 2, 1), (report.rows, report.rejects, report.overlaps))
+            self.assertEqual(["line 19", "line 20"], [err.split(":")[0] for err in report.errors])
+
+    def test_compact(self):
+        "test geoip compact"
+        with tempfile.TemporaryDirectory() as tmp:
+            geofile = Path(tmp) / "geoipwhois_compact.csv"
+            geofile.write_text(
+                self.GEOCSV_PATH.read_text()
+                + '"2.16.8.0","2.16.8.255","34605056","34605311","DE","Germany"\n'
+                + '"2.16.8.128","2.16.9.255","34605184","34605567","FR","France"\n'
+            )
+            geo = GeoIP(geofile, compact=True)
+            report = geo.load_report
+            self.assertEqual((19, 1, 1), (report.rows, report.merged, report.overlaps))
+            self.assertEqual(1, len(report.conflicts))
+            # the (narrower) DE row wins where it overlaps FR, merged or not.
+            self.assertEqual([("2.16.6.0", "2.16.8.255")], geo.get_country_range("DE"))
+            self.assertEqual([("2.16.9.0", "2.16.9.255")], geo.get_country_range("FR"))
+            for ip in list(self.country_ips.values()) + ["1.4.255.255", "200.1.2.3"]:
+                self.assertEqual(self.geo.locate(ip), geo.locate(ip))
+
+    def test_compact_overlaps(self):
+        "test geoip compact answers as without compacting, with overlapping ranges"
+        with tempfile.TemporaryDirectory() as tmp:
+            geofile = Path(tmp) / "geoipwhois_conflicts.csv"
+            geofile.write_text(
+                '"1.0.0.0","1.0.0.100","16777216","16777316","AU","Australia"\n'
+                '"1.0.0.101","1.0.0.200","16777317","16777416","AU","Australia"\n'
+                '"1.0.0.150","1.0.1.44","16777366","16777516","CN","China"\n'
+                '"1.0.1.0","1.0.1.255","16777472","16777727","JP","Japan"\n'
+            )
+            compiled = Path(tmp) / "geoipwhois_conflicts.bin"
+            GeoIP.compile(geofile, compiled, compact=True)
+            geo = GeoIP(geofile)
+            ips = [f"1.0.{third}.{fourth}" for third in (0, 1, 2) for fourth in range(256)]
+            for compact in [GeoIP(geofile, compact=True), GeoIP.from_compiled(compiled)]:
+                self.assertEqual(geo.batch_locate(ips), compact.batch_locate(ips))
+            self.assertEqual("AU", geo.locate("1.0.0.160").country["code"])
+            report = GeoIP(geofile, compact=True).load_report
+            self.assertEqual((1, 2, 2), (report.merged, report.overlaps, len(report.conflicts)))
+
+    def test_locate_ipv6(self):
+        "test geoip.locate with IPv4 + IPv6 ranges"
+        with tempfile.TemporaryDirectory() as tmp:
+            geofile = Path(tmp) / "geoipwhois_mixed.csv"
+            geofile.write_text(self.GEOCSV_PATH.read_text() + self.GEOCSV6_PATH.read_text())
+            compiled = Path(tmp) / "geoipwhois_mixed.bin"
+            GeoIP.compile(geofile, compiled)
+            for geo in [GeoIP(geofile), GeoIP.from_compiled(compiled)]:
+                self.assertEqual(geo.load_report.rows, 26)
+                located = geo.batch_locate(
+                    ["2001:218::1", "2001:4c08:1::", "2001:210::1", "::ffff:1.21.3.4", "1.21.3.4"]
+                )
+                self.assertEqual(
+                    ["JP", "DE", None, "JP", "JP"],
+                    [loc.country.code if loc else None for loc in located],
+                )
+                self.assertEqual("2001:218::1", located[0].ip)
+            self.assertEqual(
+                [("2001:4c08::", "2001:4c08:ffff:ffff:ffff:ffff:ffff:ffff")],
+                GeoIP(geofile).get_country_range("DE")[1:],
+            )
+
+    def test_batch_locate_parallel(self):
+        "test geoip.batch_locate_parallel"
+        ips = list(self.country_ips.values()) * 3 + ["1.4.255.255", IPv4("1.21.3.4")]
+        located = self.geo.batch_locate_parallel(iter(ips), workers=2, chunk_size=2)
+        self.assertEqual(self.geo.batch_locate(ips), list(located))
+
+    def test_locate_cache(self):
+        "test geoip.locate cache"
+        geo = GeoIP(self.GEOCSV_PATH, cache_size=2)
+        self.assertIsNone(self.geo.cache_info())
+        ips = [self.country_ips.get(cc) for cc in ["DE", "JP", "DE", "KR", "JP"]]
+        self.assertEqual(self.geo.batch_locate(ips), geo.batch_locate(ips))
+        self.assertEqual((1, 4, 2, 2, 2), tuple(geo.cache_info()))
+        self.assertEqual(geo.locate(IPv4("1.16.1.2")), self.geo.locate("1.16.1.2"))
+        geo.reload(self.GEOCSV_PATH)
+        self.assertEqual((0, 0, 0, 2, 0), tuple(geo.cache_info()))
+
+    def test_batch_locate_ndjson(self):
+        "test geoip.batch_locate_ndjson"
+        ips = list(self.country_ips.values()) + ["1.4.255.255"]
+        out = io.StringIO()
+        self.assertEqual(3, self.geo.batch_locate_ndjson(iter(ips), out))
+        self.assertEqual(
+            json.loads(self.geo.batch_locate_serialized(ips)),
+            [json.loads(line) for line in out.getvalue().splitlines()],
+        )
@@ -1,11 +1,24 @@
+import io
+import bz2
+import gzip
 import json
+import lzma
 
+from array import array
 from pathlib import Path
+from tempfile import TemporaryDirectory
 from unittest import TestCase
 
 from grait import IPGrabber
 from grait.utils import IPobject
+from grait.utils import IPv4Set
+from grait.utils import IPGrabberCheckpoint
+from grait.utils import orjson
+from grait.utils import json_dumps
+from grait.utils import set_json_backend
 from grait.utils import str_to_ipv4
+from grait.utils import open_input
+from grait.utils import zstandard
 
 class IPGrabberTestCase(TestCase):
     IPFILE_PATH = Path(__file__).parent / "test_data/grabber_test.txt"
@@ -22,16 +35,23 @@ class IPGrabberTestCase(TestCase):
             "15.190.43.42",
             "212.219.78.78",
         ]
+        self.ip_lines = [1, 2, 4, 4, 6, 7, 8, 9]
         ipobject_list = []
-        for ip_ in self.ip_list:
+        for ip_, lineno in zip(self.ip_list, self.ip_lines):
             ip = str_to_ipv4(ip_)
             ipobject_list.append (
                 IPobject(
-                    **{"ip": ip_, "object": ip, "is_valid": ip.is_global}
+                    **{
+                        "ip": ip_,
+                        "object": ip,
+                        "is_valid": ip.is_global,
+                        "first_line": lineno,
+                        "last_line": lineno,
+                    }
                 )
             )
         self.result = tuple(ipobject_list)
-        self.result_serialized = json.dumps([row.asdict() for row in self.result])
+        self.result_serialized = json_dumps([row.asdict() for row in self.result])
 
 
     def test_grab_ips(self):
@@ -46,3 +66,216 @@ class IPGrabberTestCase(TestCase):
     def test_result_serialized(self):
         "test results serialized"
         self.assertEqual(self.result_serialized, self.ipg.get_result_serialized())
+
+    def test_result_compact(self):
+        "test compact results"
+        ipg = IPGrabber(self.IPFILE_PATH, compact=True)
+        self.assertEqual(self.result, ipg.get_result())
+        self.assertEqual(self.result_serialized, ipg.get_result_serialized())
+
+    def test_result_fields(self):
+        "test results serialized with only some IPv4 fields"
+        fields = ["compressed", "is_global"]
+        expected = json.loads(self.result_serialized)
+        for row in expected:
+            row["object"] = {attr: row["object"][attr] for attr in fields}
+        for compact in (False, True):
+            ipg = IPGrabber(self.IPFILE_PATH, compact=compact)
+            self.assertEqual(expected, json.loads(ipg.get_result_serialized(fields)))
+            text = io.StringIO()
+            ipg.write_result_ndjson(text, fields)
+            self.assertEqual(
+                expected, [json.loads(line) for line in text.getvalue().splitlines()]
+            )
+
+    def test_result_ndjson(self):
+        "test results as NDJSON, with every JSON backend"
+        for backend in ["json", "orjson"] if orjson else ["json"]:
+            set_json_backend(backend)
+            text, binary = io.StringIO(), io.BytesIO()
+            self.assertEqual(len(self.result), self.ipg.write_result_ndjson(text))
+            self.ipg.write_result_ndjson(binary)
+            self.assertEqual(text.getvalue().encode("utf8"), binary.getvalue())
+            self.assertEqual(
+                [row.asdict() for row in self.result],
+                [json.loads(line) for line in text.getvalue().splitlines()],
+            )
+        set_json_backend("orjson" if orjson else "json")
+
+    def test_ipv4set(self):
+        "test utils.IPv4Set, with sorted arrays and bitmaps"
+        ips = [0, 1, 2 ** 32 - 1, 16909060] + [(10 << 24) | i * 7 for i in range(6000)]
+        ipset = IPv4Set()
+        self.assertEqual([True] * len(ips), [ipset.add(ip) for ip in ips])
+        self.assertEqual([False] * len(ips), [ipset.add(ip) for ip in ips])
+        self.assertEqual(len(ips), len(ipset))
+        self.assertEqual(sorted(ips), list(ipset))
+        self.assertIsInstance(ipset._groups[10 << 8], bytearray)
+        self.assertIsInstance(ipset._groups[16909060 >> 16], array)
+        for ip in ips:
+            self.assertIn(ip, ipset)
+        for ip in (3, 16909061, (10 << 24) | 1, (10 << 24) | 2 ** 16 * 7):
+            self.assertNotIn(ip, ipset)
+        self.assertEqual(list(IPv4Set(reversed(ips))), list(ipset))
+
+    def test_iter_results(self):
+        "test streaming results, with IPs split across chunks"
+        result = [(row.ip, row.is_valid) for row in self.result]
+        for chunk_size in (1, 7, 16, 4096):
+            self.assertEqual(
+                result,
+                [(row.ip, row.is_valid) for row in self.ipg.iter_results(chunk_size)],
+            )
+        ipg = IPGrabber(self.IPFILE_PATH, compact=True)
+        self.assertEqual(
+            result, [(row.ip, row.is_valid) for row in ipg.iter_results(5)]
+        )
+
+    def test_iter_results_boundaries(self):
+        "test streaming results, regex boundaries and invalid IPs"
+        text = "a1.2.3.4 1.2.3.4.5 300.1.1.1 8.8.8.8\n8.8.8.8,1.1.1.1"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "ips.txt"
+            ipfile.write_text(text)
+            ipg = IPGrabber(ipfile)
+            for chunk_size in range(1, len(text) + 1):
+                result = [row.ip for row in ipg.iter_results(chunk_size, dedup=False)]
+                self.assertEqual(
+                    ["1.2.3.4", "8.8.8.8", "8.8.8.8", "1.1.1.1"], result
+                )
+            self.assertEqual(
+                ["1.2.3.4", "8.8.8.8", "1.1.1.1"],
+                [row.ip for row in ipg.iter_results(3)],
+            )
+
+    def test_engine_mmap(self):
+        "test the mmap engine matches the lines engine"
+        ipg = IPGrabber(self.IPFILE_PATH, engine="mmap")
+        self.assertEqual(self.result, ipg.get_result())
+        offsets = dict((ip, offset) for offset, ip in reversed(list(ipg.iter_matches())))
+        text = self.IPFILE_PATH.read_bytes()
+        for ip in self.ip_list:
+            self.assertEqual(text.index(ip.encode("ascii")), offsets[ip.encode("ascii")])
+        with self.assertRaises(AssertionError):
+            IPGrabber(self.IPFILE_PATH, engine="nope")
+        # non ASCII chars (not word chars, nor digits) and bare "\r"s (not line ends).
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "ips.txt"
+            ipfile.write_bytes("café1.2.3.4 ok\nx\ry 8.8.8.8\n١.٢.٣.٤ 8.8.8.8\n".encode("utf8"))
+            for engine in IPGrabber.ENGINES:
+                result = IPGrabber(ipfile, engine=engine).get_result()
+                self.assertEqual(
+                    [("1.2.3.4", 1, 1, 1), ("8.8.8.8", 2, 2, 3)],
+                    [(row.ip, row.count, row.first_line, row.last_line) for row in result],
+                )
+
+    def test_engine_mmap_empty(self):
+        "test the mmap engine on an empty file"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "empty.txt"
+            ipfile.touch()
+            self.assertEqual((), IPGrabber(ipfile, engine="mmap").get_result())
+
+    def test_result_counts(self):
+        "test occurrence counts, line numbers and invalid IPs"
+        text = "8.8.8.8 1.1.1.1\n300.1.1.1\n\n1.1.1.1 x 1.1.1.1\n300.1.1.1 8.8.8.8"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "ips.txt"
+            ipfile.write_text(text)
+            for engine in IPGrabber.ENGINES:
+                for compact in (False, True):
+                    result = IPGrabber(ipfile, compact, engine).get_result()
+                    self.assertEqual(
+                        [("8.8.8.8", 2, 1, 5), ("1.1.1.1", 3, 1, 4)],
+                        [
+                            (row.ip, row.count, row.first_line, row.last_line)
+                            for row in result
+                        ],
+                    )
+                    self.assertEqual(3, result[1].asdict()["count"])
+
+    def test_from_paths(self):
+        "test merged results from many files, with and without workers"
+        with TemporaryDirectory() as tmp:
+            ipfiles = [Path(tmp) / "ips.1.txt", Path(tmp) / "ips.2.txt"]
+            ipfiles[0].write_text("8.8.8.8\n300.1.1.1 82.229.199.149\n")
+            ipfiles[1].write_text("\n\n1.1.1.1 8.8.8.8\n")
+            paths = [self.IPFILE_PATH] + ipfiles
+            for workers in (1, 2):
+                result = IPGrabber.from_paths(paths, workers=workers).get_result()
+                self.assertEqual(
+                    self.ip_list + ["8.8.8.8", "1.1.1.1"], [row.ip for row in result]
+                )
+                counts = [(row.count, row.first_line, row.last_line) for row in result]
+                self.assertEqual((2, 1, 2), counts[0])
+                self.assertEqual((2, 1, 3), counts[-2])
+                self.assertEqual(self.result[1:], result[1:-2])
+            ipg = IPGrabber.from_paths(paths, workers=2, compact=True, engine="mmap")
+            self.assertEqual(result, ipg.get_result())
+            self.assertEqual(
+                [row.ip for row in result],
+                [row.ip for row in ipg.iter_results(chunk_size=3)],
+            )
+            with self.assertRaises(AssertionError):
+                IPGrabber.from_paths([Path(tmp) / "nope.txt"])
+
+    def test_compressed(self):
+        "test results from compressed files, with every engine"
+        compressors = [("gz", gzip.compress), ("bz2", bz2.compress), ("xz", lzma.compress)]
+        if zstandard:
+            compressors.append(("zst", zstandard.ZstdCompressor().compress))
+        with TemporaryDirectory() as tmp:
+            for ext, compress in compressors:
+                ipfile = Path(tmp) / f"grabber_test.{ext}"
+                ipfile.write_bytes(compress(self.IPFILE_PATH.read_bytes()))
+                for engine in IPGrabber.ENGINES:
+                    ipg = IPGrabber(ipfile, engine=engine)
+                    self.assertEqual(self.result, ipg.get_result())
+                self.assertEqual(
+                    self.ip_list, [row.ip for row in ipg.iter_results(chunk_size=5)]
+                )
+                with open_input(ipfile, "rb", threaded=False) as ipf:
+                    self.assertEqual(self.IPFILE_PATH.read_bytes(), ipf.read())
+
+    def test_compressed_corrupted(self):
+        "test errors while decompressing get to the reader"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "grabber_test.gz"
+            ipfile.write_bytes(gzip.compress(self.IPFILE_PATH.read_bytes())[:-12])
+            with self.assertRaises(EOFError):
+                IPGrabber(ipfile).get_result()
+
+    def test_iter_new(self):
+        "test incremental scans: appended lines, partial lines, rotation"
+        with TemporaryDirectory() as tmp:
+            ipfile, checkpoint = Path(tmp) / "access.log", Path(tmp) / "checkpoint"
+            ipfile.write_text("8.8.8.8\n1.1.1.1 8.8.8.8\n9.9.9")
+            ipg = IPGrabber(ipfile)
+            new = [(row.ip, row.first_line) for row in ipg.iter_new(checkpoint)]
+            self.assertEqual([("8.8.8.8", 1), ("1.1.1.1", 2)], new)
+            self.assertEqual([], list(ipg.iter_new(checkpoint)))
+            with open(ipfile, "a") as ipf:
+                ipf.write(".9 1.1.1.1\n\n4.4.4.4\n")
+            new = [(row.ip, row.first_line) for row in ipg.iter_new(checkpoint, 4)]
+            self.assertEqual([("9.9.9.9", 3), ("4.4.4.4", 5)], new)
+            saved = IPGrabberCheckpoint.load(checkpoint)
+            self.assertEqual((len(ipfile.read_bytes()), 5), (saved.offset, saved.line))
+            self.assertEqual(4, len(saved.seen))
+            # rotated: a new file, only IPs never seen before are new.
+            ipfile.unlink()
+            ipfile.write_text("4.4.4.4 5.5.5.5\n")
+            self.assertEqual(["5.5.5.5"], [row.ip for row in ipg.iter_new(checkpoint)])
+            with self.assertRaises(AssertionError):
+                list(IPGrabber(self.IPFILE_PATH).iter_new(checkpoint))
+
+    def test_follow(self):
+        "test following a growing file"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "access.log"
+            ipfile.write_text("8.8.8.8\n")
+            follow = IPGrabber(ipfile, compact=True).follow(interval=0.01)
+            self.assertEqual("8.8.8.8", next(follow).ip)
+            with open(ipfile, "a") as ipf:
+                ipf.write("8.8.8.8 1.1.1.1\n")
+            self.assertEqual("1.1.1.1", next(follow).ip)
+            follow.close()
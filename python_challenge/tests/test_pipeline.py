@@ -0,0 +1,114 @@
+import io
+import json
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from grait import GeoIP
+from grait import IPGrabber
+from grait import Pipeline
+from grait.utils import RDAPResponse
+
+
+class FakeRDAP:
+    "Answers every RDAP lookup with the same (APNIC) response, no network involved."
+
+    RESPONSE_PATH = Path(__file__).parent / "test_data/apnic_response.json"
+
+    def __init__(self):
+        self.lookups = []
+        self.malformed = set()
+        with open(self.RESPONSE_PATH) as response:
+            self.response = RDAPResponse(json.load(response))
+
+    def lookup(self, ip_addr):
+        self.lookups.append(ip_addr)
+        if ip_addr in self.malformed:
+            raise ValueError("Expecting value: line 1 column 1 (char 0)")
+        return self.response
+
+
+class PipelineTestCase(TestCase):
+    IPFILE_PATH = Path(__file__).parent / "test_data/grabber_test.txt"
+    GEOCSV_PATH = Path(__file__).parent / "test_data/geoipwhois_test.csv"
+
+    def setUp(self):
+        self.ipg = IPGrabber(self.IPFILE_PATH)
+        self.geo = GeoIP(self.GEOCSV_PATH)
+
+    def test_run(self):
+        "test pipeline.run"
+        records = list(Pipeline(self.ipg, self.geo, batch_size=3, queue_size=1).run())
+        self.assertEqual(
+            [row.ip for row in self.ipg.get_result()], [rec["ip"] for rec in records]
+        )
+        for record in records:
+            located = self.geo.locate(record["ip"])
+            country = located.asdict()["country"] if located else None
+            self.assertEqual(country, record["country"])
+            self.assertNotIn("rdap", record)
+
+    def test_run_rdap(self):
+        "test pipeline.run with an RDAP stage"
+        rdap = FakeRDAP()
+        records = list(Pipeline(self.ipg, self.geo, rdap, batch_size=2).run())
+        valid = [row.ip for row in self.ipg.get_result() if row.is_valid]
+        self.assertEqual(sorted(valid), sorted(rdap.lookups))
+        for record in records:
+            if record["is_valid"]:
+                self.assertEqual(rdap.response.asdict(), record["rdap"])
+            else:
+                self.assertIsNone(record["rdap"])
+
+    def test_run_rdap_malformed(self):
+        "test pipeline.run goes on when an RDAP response is malformed"
+        rdap = FakeRDAP()
+        valid = [row.ip for row in self.ipg.get_result() if row.is_valid]
+        rdap.malformed = set(valid[:2])
+        records = list(Pipeline(self.ipg, self.geo, rdap, batch_size=1).run())
+        self.assertEqual(len(self.ipg.get_result()), len(records))
+        for record in records:
+            if record["ip"] in rdap.malformed or not record["is_valid"]:
+                self.assertIsNone(record["rdap"])
+            else:
+                self.assertEqual(rdap.response.asdict(), record["rdap"])
+
+    def test_write_ndjson(self):
+        "test pipeline.write_ndjson"
+        out = io.StringIO()
+        pipeline = Pipeline(self.ipg, self.geo)
+        self.assertEqual(len(self.ipg.get_result()), pipeline.write_ndjson(out))
+        self.assertEqual(
+            list(pipeline.run()),
+            [json.loads(line) for line in out.getvalue().splitlines()],
+        )
+
+    def test_close_early(self):
+        "test closing pipeline.run stops every stage"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "ips.txt"
+            ipfile.write_text("\n".join(f"8.8.{i // 256}.{i % 256}" for i in range(5000)))
+            pipeline = Pipeline(IPGrabber(ipfile), self.geo, batch_size=10, queue_size=1)
+            run = pipeline.run()
+            self.assertEqual("8.8.0.0", next(run)["ip"])
+            run.close()
+
+    def test_errors(self):
+        "test errors in a stage get to the consumer"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "ips.txt"
+            ipfile.write_text("8.8.8.8")
+            ipg = IPGrabber(ipfile)
+            ipfile.unlink()
+            with self.assertRaises(FileNotFoundError):
+                list(Pipeline(ipg, self.geo).run())
+
+    def test_run_located(self):
+        "test pipeline.run locates IPs"
+        with TemporaryDirectory() as tmp:
+            ipfile = Path(tmp) / "ips.txt"
+            ipfile.write_text("GET / 1.5.0.0\nGET / 200.1.2.3\n")
+            records = list(Pipeline(IPGrabber(ipfile), self.geo).run())
+            self.assertEqual("JP", records[0]["country"]["code"])
+            self.assertIsNone(records[1]["country"])
@@ -1,6 +1,13 @@
+import os
 import json
+import time
+import tempfile
+import asyncio
 import requests
+import threading
 
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
 from pathlib import Path
 from unittest import TestCase
 
@@ -9,9 +16,17 @@ from unittest import TestCase
 # from unittest.mock import patch
 
 from grait import RDAP
+from grait import RDAPCache
+from grait.utils import json_dumps
 from grait.utils import str_to_ipv4
 from grait.utils import RDAPService
 from grait.utils import RDAPResponse
+from grait.utils import CompactRDAPResponse
+from grait.utils import http_get
+from grait.utils import PrefixTable
+from grait.utils import make_session
+from grait.utils import get_session
+from grait.utils import set_session
 
 
 def json_load(path):
@@ -21,13 +36,93 @@ def json_load(path):
     return dct
 
 
+class StubRDAPHandler(BaseHTTPRequestHandler):
+    "A local RDAP server: /ipv4.json (bootstrap) and /<registry>/ip/<ip> (lookups)."
+
+    APNIC_RESPONSE_PATH = Path(__file__).parent / "test_data/apnic_response.json"
+    # keep-alive, see test_keep_alive.
+    protocol_version = "HTTP/1.1"
+    in_flight = {}
+    max_in_flight = {}
+    requests = []
+    clients = set()
+    failures = 0
+    # the bootstrap file, its ETag and the conditional GETs it got (If-None-Match).
+    publication = "2019-06-07T19:00:02Z"
+    bootstrap_requests = []
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/rdap+json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.path == "/ipv4.json":
+            self.send_header("ETag", f'"{self.publication}"')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        base = f"http://127.0.0.1:{self.server.server_port}"
+        with self.lock:
+            self.clients.add(self.client_address)
+        if self.path == "/flaky":
+            with self.lock:
+                StubRDAPHandler.failures -= 1
+                failing = StubRDAPHandler.failures >= 0
+            return self._send_json(503 if failing else 200, {"failing": failing})
+        if self.path == "/ipv4.json":
+            etag = f'"{self.publication}"'
+            with self.lock:
+                self.bootstrap_requests.append(self.headers.get("If-None-Match"))
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                return self.end_headers()
+            return self._send_json(
+                200,
+                {
+                    "publication": self.publication,
+                    "services": [
+                        [["1.0.0.0/8", "112.0.0.0/8"], [f"{base}/apnic/"]],
+                        [["2.0.0.0/8", "1.99.0.0/16"], [f"{base}/ripe/"]],
+                    ],
+                },
+            )
+        registry, _, ip_addr = self.path.strip("/").split("/")
+        with self.lock:
+            self.requests.append(ip_addr)
+            self.in_flight[registry] = self.in_flight.get(registry, 0) + 1
+            self.max_in_flight[registry] = max(
+                self.in_flight[registry], self.max_in_flight.get(registry, 0)
+            )
+        time.sleep(0.02)
+        with self.lock:
+            self.in_flight[registry] -= 1
+        if ip_addr.endswith(".0"):
+            return self._send_json(404, {"errorCode": 404})
+        if ip_addr.endswith(".254"):
+            return self._send_json(429, {"errorCode": 429})
+        # the APNIC response, for the /24 network of the IP.
+        response = json_load(self.APNIC_RESPONSE_PATH)
+        network = ip_addr.rsplit(".", 1)[0]
+        response["startAddress"] = f"{network}.0"
+        response["endAddress"] = f"{network}.255"
+        return self._send_json(200, response)
+
+
 class RDAPTestCase(TestCase):
     IPV4_PATH = Path(__file__).parent / "test_data/iana_rdap_ipv4.json"
     APNIC_RESPONSE_PATH = Path(__file__).parent / "test_data/apnic_response.json"
 
     def setUp(self):
-        self.rdap = RDAP()
-        self.rdap._ipv4_json = json_load(self.IPV4_PATH)
+        # no network: a local bootstrap file and the APNIC response already cached.
+        self.rdap = RDAP(cache=RDAPCache(), bootstrap=self.IPV4_PATH)
+        self.rdap.cache.put("112.2.3.4", json_load(self.APNIC_RESPONSE_PATH))
         self.apnic = RDAPService(
             domain="https://rdap.apnic.net/",
             ranges=[
@@ -99,5 +194,295 @@ class RDAPTestCase(TestCase):
     def test_lookup_serialized(self):
         self.assertEqual(
             self.rdap.lookup_serialized("112.2.3.4"),
-            json.dumps(self.apnic_response.asdict()),
+            json_dumps(self.apnic_response.asdict()),
         )
+
+
+class StubRDAPTestCase(TestCase):
+    "Runs an RDAP against a StubRDAPHandler server."
+
+    APNIC_RESPONSE_PATH = Path(__file__).parent / "test_data/apnic_response.json"
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubRDAPHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        StubRDAPHandler.max_in_flight.clear()
+        StubRDAPHandler.requests.clear()
+        StubRDAPHandler.clients.clear()
+        StubRDAPHandler.bootstrap_requests.clear()
+        StubRDAPHandler.publication = "2019-06-07T19:00:02Z"
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.bootstrap = f"http://127.0.0.1:{self.server.server_port}/ipv4.json"
+        self.bootstrap_cache = Path(self.tmp_dir.name) / "iana_rdap_ipv4.json"
+        self.rdap = RDAP(bootstrap=self.bootstrap, bootstrap_cache=self.bootstrap_cache)
+        self.apnic_response = RDAPResponse(data=json_load(self.APNIC_RESPONSE_PATH))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp_dir.cleanup()
+
+    def abatch_lookup(self, ip_addresses, **kwargs):
+        async def lookups():
+            return [lu async for lu in self.rdap.abatch_lookup(ip_addresses, **kwargs)]
+
+        return asyncio.run(lookups())
+
+
+class PrefixTableTestCase(TestCase):
+    def test_get(self):
+        "test prefixtable.get, the longest prefix wins"
+        table = PrefixTable()
+        table.add("41.0.0.0/8", "afrinic")
+        table.add("41.2.0.0/16", "ripe")
+        table.add("41.2.3.4/32", "host")
+        table.add("0.0.0.0/0", "default")
+        self.assertEqual(4, len(table))
+        self.assertEqual("afrinic", table.get("41.0.0.1"))
+        self.assertEqual("ripe", table.get("41.2.255.255"))
+        self.assertEqual("host", table.get("41.2.3.4"))
+        self.assertEqual("afrinic", table.get(str_to_ipv4("41.3.0.0")))
+        self.assertEqual("default", table.get("42.0.0.0"))
+        self.assertIsNone(PrefixTable().get(0))
+
+
+class StubRDAPServicesTestCase(StubRDAPTestCase):
+    def test_find_service(self):
+        "test rdap.find_service, nested ranges"
+        apnic, ripe = self.rdap.find_service("1.2.3.4"), self.rdap.find_service("2.2.3.4")
+        self.assertTrue(apnic.domain.endswith("/apnic/"))
+        self.assertTrue(ripe.domain.endswith("/ripe/"))
+        self.assertEqual(ripe, self.rdap.find_service("1.99.3.4"))
+        self.assertEqual(apnic, self.rdap.find_service("1.100.0.0"))
+        self.assertEqual(apnic, self.rdap.find_service("1"))
+        self.assertIsNone(self.rdap.find_service("9.9.9.9"))
+
+    def test_get_services_cached(self):
+        "test rdap.get_services is built once per bootstrap file"
+        services = self.rdap.get_services()
+        self.assertIs(services, self.rdap.get_services())
+        self.rdap._ipv4_json = dict(self.rdap._ipv4_json, services=[])
+        self.assertEqual({}, self.rdap.get_services())
+        self.assertIsNone(self.rdap.find_service("1.2.3.4"))
+
+    def test_query_ip_data(self):
+        "test rdapservice.query_ip_data, failures worth retrying"
+        service = self.rdap.find_service("1.2.3.4")
+        self.assertEqual("1.2.3.0", service.query_ip_data("1.2.3.4")["startAddress"])
+        self.assertIsNone(service.query_ip_data("1.2.3.0", retry_later=RDAPCache.MISSING))
+        self.assertIsNone(service.query_ip_data("1.2.3.254"))
+        self.assertIs(RDAPCache.MISSING, service.query_ip_data("1.2.3.254", RDAPCache.MISSING))
+        self.assertIsNone(service.query_ip("1.2.3.254"))
+
+
+class BootstrapTestCase(StubRDAPTestCase):
+    def test_local(self):
+        "test rdap with a local bootstrap file, no requests"
+        rdap = RDAP(bootstrap=RDAPTestCase.IPV4_PATH, bootstrap_cache=self.bootstrap_cache)
+        self.assertEqual("https://rdap.apnic.net/", rdap.find_service("36.1.2.3").domain)
+        self.assertFalse(rdap.refresh_bootstrap())
+        self.assertEqual(1, len(StubRDAPHandler.bootstrap_requests))
+
+    def test_saved(self):
+        "test the bootstrap file is saved and loaded from disk, without a request"
+        saved = json_load(self.bootstrap_cache)
+        self.assertEqual(self.bootstrap, saved["url"])
+        self.assertEqual('"2019-06-07T19:00:02Z"', saved["etag"])
+        self.assertEqual(self.rdap._ipv4_json, saved["data"])
+
+        rdap = RDAP(bootstrap=self.bootstrap, bootstrap_cache=self.bootstrap_cache)
+        self.assertIsNone(rdap._refresh_thread)
+        self.assertEqual(self.rdap.find_service("1.2.3.4"), rdap.find_service("1.2.3.4"))
+        self.assertEqual([None], StubRDAPHandler.bootstrap_requests)
+
+        # a copy from another URL is not used.
+        rdap.bootstrap = "https://rdap.example/ipv4.json"
+        self.assertIsNone(rdap._load_bootstrap())
+
+    def test_refresh(self):
+        "test the saved bootstrap file is refreshed in the background, with conditional GETs"
+        rdap = RDAP(bootstrap=self.bootstrap, bootstrap_cache=self.bootstrap_cache, refresh_after=0)
+        rdap._refresh_thread.join()
+        self.assertEqual([None, '"2019-06-07T19:00:02Z"'], StubRDAPHandler.bootstrap_requests)
+
+        services = rdap.get_services()
+        StubRDAPHandler.publication = "2021-01-01T00:00:00Z"
+        self.assertTrue(rdap.refresh_bootstrap())
+        self.assertIsNot(services, rdap.get_services())
+        self.assertEqual("2021-01-01T00:00:00Z", rdap.find_service("1.2.3.4").publication)
+        self.assertEqual("2021-01-01T00:00:00Z", json_load(self.bootstrap_cache)["publication"])
+        self.assertFalse(rdap.refresh_bootstrap())
+
+    def test_offline(self):
+        "test a saved bootstrap file is used when the network is down"
+        self.server.shutdown()
+        self.server.server_close()
+        rdap = RDAP(bootstrap=self.bootstrap, bootstrap_cache=self.bootstrap_cache, refresh_after=0)
+        rdap._refresh_thread.join()
+        self.assertEqual(self.rdap.find_service("1.2.3.4"), rdap.find_service("1.2.3.4"))
+
+
+class AsyncRDAPTestCase(StubRDAPTestCase):
+    def test_abatch_lookup(self):
+        "test rdap.abatch_lookup, concurrency is limited per service"
+        ips = [f"{first}.2.3.{i}" for first in (1, 2, 112) for i in range(1, 7)]
+        ips_ = ips + ["1.2.3.0", "9.9.9.9"]
+        lookups = self.abatch_lookup(ips_, concurrency=2, rate=None)
+        self.assertEqual(sorted(ips_), sorted(ip for ip, _ in lookups))
+        lookups = dict(lookups)
+        for ip in ips:
+            self.assertEqual(self.apnic_response.name, lookups[ip].name)
+            self.assertEqual(ip.rsplit(".", 1)[0] + ".0", lookups[ip].start_addr)
+        self.assertIsNone(lookups["1.2.3.0"])
+        self.assertIsNone(lookups["9.9.9.9"])
+        self.assertEqual({"apnic": 2, "ripe": 2}, StubRDAPHandler.max_in_flight)
+
+    def test_abatch_lookup_rate(self):
+        "test rdap.abatch_lookup, requests are rate limited per service"
+        ripe = self.rdap.find_service("2").domain
+        started = time.monotonic()
+        self.abatch_lookup(
+            [f"2.2.3.{i}" for i in range(1, 7)] + [f"1.2.3.{i}" for i in range(1, 7)],
+            rate=None,
+            rate_limits={ripe: 20.0},
+        )
+        # 6 requests, the first one is free: at least 5 / 20 seconds.
+        self.assertGreaterEqual(time.monotonic() - started, 0.25)
+        self.assertEqual(1, StubRDAPHandler.max_in_flight["ripe"])
+
+    def test_lookup_cached(self):
+        "test rdap.lookup with an RDAPCache, any IP in a cached network is a hit"
+        self.rdap.cache = RDAPCache()
+        first = self.rdap.lookup("1.2.3.4")
+        self.assertEqual(first, self.rdap.lookup("1.2.3.200"))
+        self.assertIsNone(self.rdap.lookup("1.2.4.0"))
+        self.assertIsNone(self.rdap.lookup("1.2.4.0"))
+        self.assertEqual(["1.2.3.4", "1.2.4.0"], StubRDAPHandler.requests)
+        ips = ["1.2.3.5", "1.2.5.1", "1.2.5.2"]
+        lookups = dict(self.abatch_lookup(ips, concurrency=1))
+        self.assertEqual(first, lookups["1.2.3.5"])
+        self.assertEqual("1.2.5.0", lookups["1.2.5.2"].start_addr)
+        self.assertEqual(["1.2.3.4", "1.2.4.0", "1.2.5.1"], StubRDAPHandler.requests)
+
+    def test_lookup_invalid(self):
+        "test rdap.lookup of invalid (or IPv6) addresses is None"
+        self.rdap.cache = RDAPCache()
+        invalid = ["not an ip", "2001:db8::1", "1.2.3", "300.1.2.3", "999"]
+        for ip in invalid:
+            self.assertIsNone(self.rdap.find_service(ip))
+            self.assertIsNone(self.rdap.lookup(ip))
+            self.assertEqual("{}", self.rdap.lookup_serialized(ip))
+        self.assertEqual(1, len(json.loads(self.rdap.batch_lookup_serialized(invalid + ["1.2.3.4"]))))
+        self.assertEqual({ip: None for ip in invalid}, dict(self.abatch_lookup(invalid)))
+        self.assertEqual(["1.2.3.4"], StubRDAPHandler.requests)
+
+    def test_lookup_compact(self):
+        "test rdap.lookup with compact=True, CompactRDAPResponses (cached or not)"
+        rdap = RDAP(
+            cache=RDAPCache(),
+            bootstrap=self.bootstrap,
+            bootstrap_cache=self.bootstrap_cache,
+            compact=True,
+        )
+        expected = self.rdap.lookup("1.2.3.4")
+        for lookup in [rdap.lookup("1.2.3.4"), rdap.lookup("1.2.3.5")]:
+            self.assertIsInstance(lookup, CompactRDAPResponse)
+            self.assertEqual(expected, lookup)
+            self.assertEqual(expected.asdict(), lookup.asdict())
+            self.assertFalse(hasattr(lookup, "__dict__"))
+        self.assertEqual(["1.2.3.4", "1.2.3.4"], StubRDAPHandler.requests)
+        self.rdap = rdap
+        lookups = dict(self.abatch_lookup(["1.2.3.6", "1.2.6.1"], rate=None))
+        self.assertTrue(all(isinstance(lu, CompactRDAPResponse) for lu in lookups.values()))
+
+    def test_lookup_throttled(self):
+        "test rdap.lookup doesn't cache throttled (429) lookups"
+        set_session(make_session(retries=0))
+        self.addCleanup(set_session, None)
+        self.rdap.cache = RDAPCache()
+        self.assertIsNone(self.rdap.lookup("1.2.3.254"))
+        self.assertIsNone(self.rdap.lookup("1.2.3.254"))
+        self.assertEqual(["1.2.3.254", "1.2.3.254"], StubRDAPHandler.requests)
+        self.assertEqual(0, len(self.rdap.cache))
+
+
+class RDAPCacheTestCase(TestCase):
+    APNIC_RESPONSE_PATH = Path(__file__).parent / "test_data/apnic_response.json"
+
+    def setUp(self):
+        self.data = json_load(self.APNIC_RESPONSE_PATH)
+
+    def test_get_put(self):
+        "test rdapcache.get and rdapcache.put, by network range"
+        cache = RDAPCache()
+        self.assertIs(RDAPCache.MISSING, cache.get("112.2.3.4"))
+        cache.put("112.2.3.4", self.data)
+        for ip in ("112.0.0.0", "112.2.3.5", "112.63.255.255"):
+            self.assertEqual(self.data, cache.get(ip))
+        self.assertIs(RDAPCache.MISSING, cache.get("112.64.0.0"))
+        # a narrower network wins.
+        narrow = dict(self.data, startAddress="112.2.3.0", endAddress="112.2.3.255")
+        cache.put("112.2.3.4", narrow)
+        self.assertEqual(narrow, cache.get("112.2.3.9"))
+        self.assertEqual(self.data, cache.get("112.2.4.9"))
+        # negative entries are per IP.
+        cache.put("9.9.9.9", None)
+        self.assertIsNone(cache.get("9.9.9.9"))
+        self.assertIs(RDAPCache.MISSING, cache.get("9.9.9.8"))
+        self.assertEqual(3, len(cache))
+
+    def test_ttl(self):
+        "test rdapcache entries expire"
+        cache = RDAPCache(ttl=60, negative_ttl=0)
+        cache.put("112.2.3.4", self.data)
+        cache.put("9.9.9.9", None)
+        self.assertIs(RDAPCache.MISSING, cache.get("9.9.9.9"))
+        self.assertEqual(1, cache.purge())
+        self.assertEqual(1, len(cache))
+
+    def test_persistent(self):
+        "test rdapcache persists"
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "rdap.sqlite"
+            with RDAPCache(path) as cache:
+                cache.put("112.2.3.4", self.data)
+            with RDAPCache(path) as cache:
+                self.assertEqual(self.data, cache.get("112.10.0.1"))
+
+    def test_persistent_home(self):
+        "test rdapcache expands ~ in its path"
+        environ = dict(os.environ)
+        self.addCleanup(lambda: (os.environ.clear(), os.environ.update(environ)))
+        with tempfile.TemporaryDirectory() as tmp:
+            os.environ["HOME"] = tmp
+            with RDAPCache("~/rdap.sqlite") as cache:
+                cache.put("112.2.3.4", self.data)
+            self.assertTrue((Path(tmp) / "rdap.sqlite").exists())
+            self.assertFalse(Path("~").exists())
+
+
+class HTTPSessionTestCase(StubRDAPTestCase):
+    def tearDown(self):
+        set_session(None)
+        super().tearDown()
+
+    def test_keep_alive(self):
+        "test lookups reuse connections"
+        for i in range(1, 6):
+            self.rdap.lookup(f"1.2.{i}.1")
+        self.assertEqual(5, len(StubRDAPHandler.requests))
+        # one for the bootstrap file and the lookups, they share the session.
+        self.assertEqual(1, len(StubRDAPHandler.clients))
+
+    def test_retries(self):
+        "test 5xx responses are retried (with backoff)"
+        url = f"http://127.0.0.1:{self.server.server_port}/flaky"
+        set_session(make_session(retries=3, backoff_factor=0.01))
+        StubRDAPHandler.failures = 2
+        self.assertEqual({"failing": False}, http_get(url).json())
+        StubRDAPHandler.failures = 5
+        response = http_get(url)
+        self.assertEqual(503, response.status_code)
+        self.assertIs(get_session(), get_session())
+        self.assertEqual(get_session().timeout, make_session().timeout)